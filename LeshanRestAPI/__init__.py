@@ -7,62 +7,535 @@ pasha.stone@sandc.com
 Alex Lundberg
 alex.lundberg@sandc.com
 '''
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait  # available since 2.4.0
-# available since 2.26.0
-from selenium.webdriver.support import expected_conditions as EC
-import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
+# selenium, ElementTree and sqlite3 are imported where they are used so the REST path starts quickly
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from html.parser import HTMLParser
+from collections import namedtuple, OrderedDict, deque
+import codecs
+import contextlib
+import fnmatch
+import functools
+import logging
+import threading
+import time
 import os
+import re
+import sys
+import weakref
 import requests
 import json
 
+
+class DefaultTimeout(float):
+    '''seconds an operation waits when the caller does not give a timeout. It is a type of its own so a
+    LatencyTracker adapts only the timeouts the caller left at the default.'''
+
+
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
-TIMEOUT = 4
+TIMEOUT = DefaultTimeout(4)
+# location of the client cache. Can be moved out of the package directory with the LESHAN_CLIENT_CACHE environment variable.
+CLIENT_CACHE = os.environ.get('LESHAN_CLIENT_CACHE',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'LeshanRestAPI', 'clients.sqlite'))
+POOL_CONNECTIONS = 10  # number of distinct hosts to keep connection pools for
+POOL_MAXSIZE = 10  # number of connections kept alive per host
+DISCOVERY = 'html'  # how uncached clients are discovered. 'html' scrapes the client page, 'json' uses the leshan REST API.
+CACHE_TTL = 5  # seconds a value read from a client is served from the value cache
+CACHE_SIZE = 1024  # maximum number of values held by the value cache
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # upper bounds in seconds of the latency histograms
+RECONNECT_DELAY = 1  # seconds to wait before reopening a dropped event stream
+STREAM_CHUNK_SIZE = 65536  # bytes read at a time when enumerating the clients of a server
+MAX_WORKERS = POOL_MAXSIZE  # concurrent operations in a fleet wide fan-out. Never more than the pool so every worker has a warm connection.
+LATENCY_WINDOW = 100  # recent response times of each endpoint that adaptive timeouts and hedging are based on
+
+log = logging.getLogger(__name__)
+
+def createSession(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=False, keep_alive=True):
+    '''returns a requests session that reuses pooled connections to the leshan server
+    Keyword arguments:
+    pool_connections -- number of hosts to keep a connection pool for
+    pool_maxsize -- maximum number of connections kept open to a single host
+    pool_block -- block when all connections to a host are in use instead of opening a throwaway one
+    keep_alive -- keep connections open between requests. False closes the connection after every request.
+    '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                            pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+def buildPageObjects(links, specs):
+    '''returns the object>instance>resources dictionary of a client from its registration and object models
+    Keyword arguments:
+    links -- objectLinks of the client registration
+    specs -- object models of the client keyed on object id, in the format of the leshan objectspecs api
+    '''
+    object_dict = {}
+    for link in links:
+        path = link['url'].strip('/').split('/')
+        # skip the root link and objects the server has no model for
+        spec = specs.get(path[0])
+        if spec is None:
+            continue
+        # object names are lower case to be consistent with the html scrape
+        instance_dict = object_dict.setdefault(spec['name'].lower(), {})
+        if len(path) < 2:
+            continue
+        object_id, instance_id = path[0], path[1]
+        resource_dict = {}
+        for resource in spec.get('resourcedefs', []):
+            resource_dict[resource['name']] = '/' + object_id + '/' + instance_id + '/' + str(resource['id'])
+        instance_dict[instance_id] = resource_dict
+    return object_dict
+
+Span = namedtuple('Span', ['operation', 'phase', 'endpoint', 'seconds'])
+NULL_SPAN = contextlib.nullcontext()  # span handed out when metrics are disabled
+
+def instrumented(operation):
+    '''decorator of Server and Client methods that records the total time and errors of operation when metrics are enabled
+    Keyword arguments:
+    operation -- name the method is recorded under
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            endpoint = getattr(self, 'client', None)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            except Exception:
+                metrics.count(operation + '_errors', endpoint)
+                raise
+            finally:
+                metrics.record(operation, 'total', endpoint, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def parsePage(html):
+    '''parses the html of the leshan client webpage into a dictionary containing each object, instance and resource
+    in a single pass over the page
+    Keyword arguments:
+    html -- text of the client page
+    '''
+    parser = _PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser.object_dict
+
+# what is left of a json document cut off inside a number or literal
+_PARTIAL_TOKEN = re.compile(r'\s*(?:-?[0-9.eE+-]*|t(?:r(?:ue?)?)?|f(?:a(?:l(?:se?)?)?)?|n(?:u(?:ll?)?)?)\Z')
+_PARTIAL_ESCAPE = re.compile(r'u[0-9a-fA-F]{0,4}\Z')  # what is left of a string cut off inside a \uXXXX escape
+
+def isPartialJSON(text, error):
+    '''returns True if error was raised decoding text because it was cut off, so it may decode once more is read
+    Keyword arguments:
+    text -- the json text that failed to decode
+    error -- JSONDecodeError raised decoding text
+    '''
+    if error.msg.startswith('Unterminated string'):
+        return True
+    if error.msg.startswith('Invalid \\uXXXX escape'):
+        return _PARTIAL_ESCAPE.match(text, error.pos) is not None
+    # anything but the start of a number or literal after the error is invalid json
+    return _PARTIAL_TOKEN.match(text, error.pos) is not None
+
+def iterJSONArray(chunks):
+    '''generator that yields each element of a top level json array as soon as it has been read,
+    so the whole document is never held in memory
+    Keyword arguments:
+    chunks -- iterable of the text of the document in pieces of any size
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    expect = '['  # '[' before the array, 'first' after it, ',' after an element and 'value' after a comma
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if expect == '[':
+                if buffer[pos] != '[':
+                    raise ValueError("expected a json array")
+                expect = 'first'
+                pos += 1
+                continue
+            if buffer[pos] == ']' and expect in ('first', ','):
+                return
+            if expect == ',':
+                if buffer[pos] != ',':
+                    raise ValueError("expected , or ] after an element of the json array at " + repr(buffer[pos:pos + 20]))
+                expect = 'value'
+                pos += 1
+                continue
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # the element has not been read completely yet if it was cut off inside its last token
+                if isPartialJSON(buffer, e):
+                    break
+                raise
+            # a number or literal is only complete when followed by a delimiter, eg. 1 may continue as 1.5
+            if buffer[pos] not in '{["' and (end == len(buffer) or buffer[end] not in ' \t\r\n,]'):
+                if _PARTIAL_TOKEN.match(buffer, pos):
+                    break
+                raise ValueError("invalid json value at " + repr(buffer[pos:pos + 20]))
+            yield element
+            pos = end
+            expect = ','
+        buffer = buffer[pos:]
+    raise ValueError("json array ended before it was closed")
+
+def linkSignature(links):
+    '''returns a string identifying the objects and instances of a registration, used to tell when a cached client is stale
+    Keyword arguments:
+    links -- objectLinks of the client registration
+    '''
+    return ','.join(sorted(link['url'] for link in links))
+
+class _PageParser(HTMLParser):
+    '''single pass parser of the leshan client page used by parsePage(). The page is a tree of
+    objects>instances>resources marked by their ng-repeat attribute. Each object and resource takes the text of
+    its first object-name or resource-name element as name, and each resource takes its id from the tooltip of
+    its first button.'''
+
+    # elements that never have an end tag so they are never opened
+    VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                     'source', 'track', 'wbr'}
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.object_dict = {}
+        self.__open = []  # stack of (tag, list of the scopes opened by the element)
+        self.__object = None  # [name, instance_dict] of the object being read
+        self.__instance = None  # resource_dict of the instance being read
+        self.__resource = None  # [name, id, button seen] of the resource being read
+        self.__text = None  # pieces of text of the name element being read
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        repeat = attrs.get('ng-repeat')
+        classes = (attrs.get('class') or '').split()
+        scopes = []
+        if repeat == 'object in objects':
+            self.__object = [None, {}]
+            scopes.append('object')
+        elif repeat == 'instance in object.instances' and self.__object is not None:
+            instance_dict = self.__object[1]
+            self.__instance = instance_dict[len(instance_dict)] = {}
+            scopes.append('instance')
+        elif repeat == 'resource in instance.resources' and self.__instance is not None:
+            self.__resource = [None, None, False]
+            scopes.append('resource')
+        if not scopes and self.__text is None:
+            # the name elements of the object or resource being read, never the object or resource element itself
+            if 'resource-name' in classes and self.__resource is not None and self.__resource[0] is None:
+                self.__text = []
+                scopes.append('resource-name')
+            elif 'object-name' in classes and self.__object is not None and self.__object[0] is None:
+                self.__text = []
+                scopes.append('object-name')
+        if tag == 'button' and 'resource' not in scopes and self.__resource is not None and not self.__resource[2]:
+            self.__resource[2] = True
+            self.__resource[1] = attrs['tooltip-html-unsafe'].split('>')[1]
+        if tag not in self.VOID_ELEMENTS:
+            self.__open.append((tag, scopes))
+        elif scopes:
+            self.__close(scopes)
+
+    def handle_endtag(self, tag):
+        # end tags without a start tag are ignored, elements left open inside this one are closed with it
+        for i in range(len(self.__open) - 1, -1, -1):
+            if self.__open[i][0] == tag:
+                while len(self.__open) > i:
+                    self.__close(self.__open.pop()[1])
+                return
+
+    def handle_data(self, data):
+        if self.__text is not None:
+            self.__text.append(data)
+
+    def close(self):
+        HTMLParser.close(self)
+        while self.__open:
+            self.__close(self.__open.pop()[1])
+
+    def __close(self, scopes):
+        '''helper method that finishes the scopes opened by an element when it closes'''
+        for scope in reversed(scopes):
+            if scope == 'object-name':
+                self.__object[0] = ''.join(self.__text).strip()
+                self.__text = None
+            elif scope == 'resource-name':
+                self.__resource[0] = ''.join(self.__text).strip()
+                self.__text = None
+            elif scope == 'resource':
+                name, resource_id, _ = self.__resource
+                if name is None or resource_id is None:
+                    raise IOError("resource without a name or id on the client page")
+                self.__instance[name] = resource_id
+                self.__resource = None
+            elif scope == 'instance':
+                self.__instance = None
+            elif scope == 'object':
+                if self.__object[0] is None:
+                    raise IOError("object without a name on the client page")
+                self.object_dict[self.__object[0]] = self.__object[1]
+                self.__object = None
 
 class Server():
     '''returns information on the clients attached to the server'''
-    def __init__(self, url):
+    def __init__(self, url, session=None, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 pool_block=False, keep_alive=True, discovery=DISCOVERY, cache=None, store=None, metrics=None,
+                 latency=None):
+        '''sets the server url and the connection pool shared with every client of this server
+        Keyword arguments:
+        url -- url of the leshan server
+        session -- requests session to use. If None a pooled session is created with the settings below.
+        pool_connections -- number of hosts to keep a connection pool for
+        pool_maxsize -- maximum number of connections kept open to a single host
+        pool_block -- block when all connections to a host are in use instead of opening a throwaway one
+        keep_alive -- keep connections open between requests
+        discovery -- how uncached clients of this server are discovered, 'html' or 'json'
+        cache -- ValueCache shared by every client of this server and updated by its event stream. If None reads are not cached.
+        store -- ClientStore the resources of the clients are cached in. If None the default store is used.
+        metrics -- Metrics that record the timing of the operations of this server and its clients. If None nothing is recorded.
+        latency -- LatencyTracker shared by every client of this server. If None the timeout of each operation is fixed.
+        '''
         self.url=url
+        self.store = store
+        self.metrics = metrics
+        self.latency = latency
+        self.discovery = discovery
+        self.cache = cache
+        self.pool_maxsize = None  # connections per host of the session, None if the session was passed in
+        if session is None:
+            session = createSession(pool_connections, pool_maxsize, pool_block, keep_alive)
+            self.pool_maxsize = pool_maxsize
+        self.session = session
+        self.clients = {}  # Client objects already built for this server keyed on endpoint
+        self.links = {}  # object links of each endpoint from the last getClients(). Endpoints with the same links share one list.
+        self.__sharedLinks = {}  # link signature to the links shared by every registration with that signature
+        self.stream = None  # event stream shared by every observation on this server
 
+    @instrumented('getClients')
     def getClients(self,timeout=TIMEOUT):
         '''return the client endpoints attached to this server'''
-        #sometimes the user may enter the url of the server with or without the #/clients appended to it.
-        if "clients" in self.url:
-            r = requests.get(self.url.replace('#','api'), timeout=timeout)
-        else:
-            r = requests.get(self.url + "/api/clients", timeout=timeout)
-        # raise error if http request fails
-        r.raise_for_status()
-        # return result
-        rDict = json.loads(r.text)
         clientList=[]
-        for client in rDict:
+        for client in self.iterClients(timeout=timeout):
             clientList.append(client['endpoint'])
+            # keep the object links so clients can check their cache without requesting the registration again
+            self.setLinks(client['endpoint'], client.get('objectLinks'))
         return clientList
 
-    def cacheClients(self,refresh=False):
-        '''return a list of client objects attached to this server and cache the clients'''
+    def iterClients(self, pattern=None, objects=None, timeout=TIMEOUT, chunk_size=STREAM_CHUNK_SIZE):
+        '''generator that yields the registration of each client attached to this server as it is read from the server.
+        Memory use does not grow with the number of clients. Pass the objectLinks of a registration to getClient()
+        so the client does not request it again.
+        Keyword arguments:
+        pattern -- only yield endpoints matching this glob eg. US-L15-*, or a compiled regular expression
+        objects -- only yield clients that have an instance of every object id in this list eg. ['3', '3303']
+        timeout -- time to do rest command before timing out
+        chunk_size -- bytes read from the server at a time
+        '''
+        #sometimes the user may enter the url of the server with or without the #/clients appended to it.
+        with self.__span('request'):
+            if "clients" in self.url:
+                r = self.session.get(self.url.replace('#','api'), timeout=timeout, stream=True)
+            else:
+                r = self.session.get(self.url + "/api/clients", timeout=timeout, stream=True)
+            # raise error if http request fails
+            r.raise_for_status()
+        objects = None if objects is None else {str(object_id).strip('/') for object_id in objects}
+        decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')()
+        chunks = (decoder.decode(chunk) for chunk in r.iter_content(chunk_size))
+        try:
+            for client in iterJSONArray(chunks):
+                if pattern is not None and not self.__matchEndpoint(pattern, client['endpoint']):
+                    continue
+                if objects is not None:
+                    supported = {link['url'].strip('/').split('/')[0] for link in client.get('objectLinks', [])}
+                    if not objects <= supported:
+                        continue
+                yield client
+        finally:
+            r.close()
+
+    def __matchEndpoint(self, pattern, endpoint):
+        '''helper method of iterClients() that checks endpoint against a glob or a compiled regular expression'''
+        if isinstance(pattern, str):
+            return fnmatch.fnmatchcase(endpoint, pattern)
+        return pattern.search(endpoint) is not None
+
+    def cacheClients(self, refresh=False, load=False, max_workers=1):
+        '''return a list of client objects attached to this server. The clients load their resources on first use
+        unless they are loaded here.
+        Keyword arguments:
+        refresh -- get the elements by scraping the html even if we have the client cached. The clients are loaded
+                   here so the cache is refreshed before this returns.
+        load -- load every client here, which caches the clients that are not cached yet
+        max_workers -- number of clients loaded at once. Each html discovery runs its own headless browser.
+        '''
         clientNames = self.getClients()
         clientList = []
         for clientName in clientNames:
-            #initialize a new client, cache it and add it to a list
-            client = Client(self.url + '/#/clients/' + clientName,refresh)
+            #initialize a new client and add it to a list
+            client = self.getClient(clientName,refresh)
             clientList.append(client)
+        if refresh or load:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for _ in executor.map(Client.load, clientList):
+                    pass
         return clientList
 
+    def getClient(self, endpoint, refresh=False, links=None):
+        '''return the client object of the given endpoint, creating it the first time it is requested
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        refresh -- get the elements by scraping the html even if we have the client cached.
+        links -- objectLinks of the client registration if already known, eg. from iterClients()
+        '''
+        client = self.clients.get(endpoint)
+        if client is None or refresh:
+            if links is None:
+                links = self.links.get(endpoint)
+            else:
+                links = self.__shareLinks(links)
+            client = Client(self.__clientUrl(endpoint), refresh, session=self.session, discovery=self.discovery,
+                            cache=self.cache, store=self.store, links=links, metrics=self.metrics, latency=self.latency)
+            self.clients[endpoint] = client
+        return client
+
+    def readAll(self, resource, object_=None, instance=None, endpoints=None, max_workers=MAX_WORKERS, timeout=TIMEOUT):
+        '''read a resource from many clients concurrently. Returns a tuple of dictionaries (results, errors)
+        keyed on endpoint, holding the value read or the exception raised for that endpoint.
+        Keyword arguments:
+        resource -- the resource to read on each client
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        endpoints -- list of endpoints to read from. If None every client attached to the server is read.
+        max_workers -- maximum number of operations in flight at once. Capped at the pool_maxsize of the server.
+        timeout -- time to do rest command before timing out
+        '''
+        return self.__fanOut('read', (resource, object_, instance, timeout), endpoints, max_workers)
+
+    def writeAll(self, text, resource, object_=None, instance=None, endpoints=None, max_workers=MAX_WORKERS, timeout=TIMEOUT):
+        '''write text to a resource on many clients concurrently. Returns a tuple of dictionaries (results, errors)
+        keyed on endpoint. results holds None for every successful write.
+        Keyword arguments:
+        text -- text to write to resource
+        resource -- the resource to write on each client
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        endpoints -- list of endpoints to write to. If None every client attached to the server is written.
+        max_workers -- maximum number of operations in flight at once. Capped at the pool_maxsize of the server.
+        timeout -- time to do rest command before timing out
+        '''
+        return self.__fanOut('write', (text, resource, object_, instance, timeout), endpoints, max_workers)
+
+    def __fanOut(self, operation, args, endpoints, max_workers):
+        '''helper method of the fleet wide operations that calls operation on each client from a bounded pool of worker threads
+        Keyword arguments:
+        operation -- name of the Client method to call
+        args -- positional arguments passed to the Client method
+        endpoints -- list of endpoints to operate on. If None every client attached to the server is used.
+        max_workers -- maximum number of operations in flight at once
+        '''
+        if endpoints is None:
+            endpoints = self.getClients()
+        max_workers = self.maxWorkers(max_workers)
+
+        def call(endpoint):
+            # each device has its own timeout so one slow device only occupies one worker
+            client = self.getClient(endpoint)
+            return getattr(client, operation)(*args)
+
+        results = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {endpoint: executor.submit(call, endpoint) for endpoint in endpoints}
+            for endpoint, future in futures.items():
+                try:
+                    results[endpoint] = future.result()
+                except Exception as e:
+                    errors[endpoint] = e
+        return results, errors
+
+    def maxWorkers(self, max_workers):
+        '''returns the number of workers that can run operations on the clients of this server at once, at most
+        max_workers. Workers beyond the connection pool would each open a connection the pool then discards.'''
+        if self.pool_maxsize is None:
+            return max_workers
+        return max(1, min(max_workers, self.pool_maxsize))
+
+    def setLinks(self, endpoint, links):
+        '''remember the objectLinks of the registration of endpoint for the client getClient() builds'''
+        self.links[endpoint] = self.__shareLinks(links)
+
+    def __shareLinks(self, links):
+        '''helper method that returns the list of links shared by every registration with the same object links,
+        so a fleet of devices of the same type holds a single copy. Only the url of each link is used.'''
+        if links is None:
+            return None
+        return self.__sharedLinks.setdefault(linkSignature(links), links)
+
+    def __span(self, phase):
+        '''helper method of getClients() and iterClients() that returns the span timing phase'''
+        if self.metrics is None:
+            return NULL_SPAN
+        return self.metrics.span('getClients', phase)
+
+    def __clientUrl(self, endpoint):
+        '''returns the url of the client page for the given endpoint'''
+        # the server url may be entered with or without the #/clients appended to it.
+        if "clients" in self.url:
+            return self.url.rstrip('/') + '/' + endpoint
+        return self.url.rstrip('/') + '/#/clients/' + endpoint
+
+    def events(self):
+        '''return the event stream of this server, creating it the first time it is requested'''
+        if self.stream is None:
+            self.stream = EventStream(self.url, self.session, cache=self.cache)
+        return self.stream
+
+    def close(self):
+        '''close the event stream and the pooled connections of this server and its clients'''
+        if self.stream is not None:
+            self.stream.stop()
+        if self.latency is not None:
+            self.latency.close()
+        self.session.close()
+
     def __str__(self):
         return self.url
 
 class Client():
     '''Wrapper class for robot libraries in python that use RESTful API'''
 
-    def __init__(self, url, refresh=False, models=None):
+    def __init__(self, url, refresh=False, models=None, session=None, discovery=DISCOVERY, cache=None, registry=None,
+                 store=None, links=None, metrics=None, latency=None):
         '''sets the information required for REST commands
         Keyword arguments:
         url -- url of the leshan client
         refresh -- get the elements by scraping the html even if we have the client cached.
+        models -- folder of xml object models to build the resources from instead of scraping the html
+        session -- pooled requests session, normally shared by the Server. If None the client creates its own.
+        discovery -- 'html' to scrape the client page with a headless browser or 'json' to build the resources from the leshan REST API
+        cache -- ValueCache to serve repeated reads from. If None every read goes to the leshan server.
+        registry -- ModelRegistry that parses the xml models. If None the registry shared by the whole process is used.
+        store -- ClientStore the resources of the client are cached in. If None the default store is used.
+        links -- objectLinks of the client registration if already known. If None they are requested from the server.
+                 They are only kept until the resources are loaded.
+        metrics -- Metrics that record the timing of the operations of this client. If None nothing is recorded.
+        latency -- LatencyTracker that sets the timeouts of this client from its response times and hedges its reads.
+                   If None the timeout given to each operation is used as is.
         '''
         self.url = url
         if 'clients' not in self.url:  #if we dont have the full clients name then we need to replace "client" with "clients"
@@ -72,8 +545,19 @@ class Client():
         self.client = self.requestUrl.split(r'/')[-1]
         self.refresh = refresh
         self.models = models
-        self.page_objects = self.__getSource()
+        self.registry = registry
+        self.store = store
+        self.links = links
+        self.discovery = discovery
+        self.cache = cache
+        self.metrics = metrics
+        self.latency = latency
+        self.session = session if session is not None else createSession()
+        # the resources are loaded on first use so building a client does not touch the network
+        self.__model = None
+        self.__loadLock = threading.Lock()
 
+    @instrumented('read')
     def read(self, resource, object_=None, instance=None, timeout=TIMEOUT):
         '''reads the value of the specified instance and resource on the leshan server
         Keyword arguments:
@@ -81,20 +565,91 @@ class Client():
         resource -- string of the resource, eg switch_1_closed, battery_test.
         '''
         # search through dictionary to find the resource id to call
-        res_id = self.__searchDictionary(resource, object_, instance)
+        with self.__span('read', 'resolve'):
+            res_id = self.__searchDictionary(resource, object_, instance)
+        # serve the value from the cache if it was read recently
+        if self.cache is not None:
+            hit, value = self.cache.get(self.client, res_id)
+            if self.metrics is not None:
+                self.metrics.count('value_cache_hit' if hit else 'value_cache_miss', self.client)
+            if hit:
+                return value
         # make request
-        r = requests.get(self.requestUrl + res_id, timeout=timeout)
-        # raise error if http request fails
-        r.raise_for_status()
+        r = self.__send('read', 'GET', res_id, timeout)
         # convert the output into a dictionary and return the result
-        rDict = json.loads(r.text)
+        with self.__span('read', 'decode'):
+            rDict = json.loads(r.text)
         # return the value of the resource
         try:
-            return rDict['content']['value']
+            value = rDict['content']['value']
         except KeyError:
             raise KeyError("resource " + resource +
                            " is not available for reading")
+        if self.cache is not None:
+            self.cache.put(self.client, res_id, value)
+        return value
+
+    @instrumented('readInstance')
+    def readInstance(self, object_, instance=0, timeout=TIMEOUT):
+        '''reads every resource of an instance in a single request and returns a dictionary of resource name to value
+        Keyword arguments:
+        object_ -- the highest level object containing the instance
+        instance -- the instance of the object to read
+        timeout -- time to do rest command before timing out
+        '''
+        with self.__span('readInstance', 'resolve'):
+            inst_path = self.__instancePath(object_, instance)
+        content = self.__readPath('readInstance', inst_path, timeout)
+        with self.__span('readInstance', 'decode'):
+            return self.__decodeInstance(inst_path, content)
 
+    @instrumented('readObject')
+    def readObject(self, object_, timeout=TIMEOUT):
+        '''reads every instance of an object in a single request and returns a dictionary of instance to a dictionary of resource name to value
+        Keyword arguments:
+        object_ -- the highest level object to read
+        timeout -- time to do rest command before timing out
+        '''
+        instances = self.page_objects.get(object_.lower()) or {}
+        if len(instances) == 0:
+            raise LookupError("Could not find an instance of object: " + object_)
+        # the object path is the instance path without the instance id eg. /3/0 -> /3
+        obj_path = self.__instancePath(object_, next(iter(instances))).rsplit('/', 1)[0]
+        content = self.__readPath('readObject', obj_path, timeout)
+        values = {}
+        with self.__span('readObject', 'decode'):
+            for inst in content.get('instances', []):
+                values[str(inst['id'])] = self.__decodeInstance(obj_path + '/' + str(inst['id']), inst)
+        return values
+
+    @instrumented('readMany')
+    def readMany(self, resources, object_=None, instance=None, timeout=TIMEOUT):
+        '''reads several resources with one request per instance they belong to and returns a dictionary of resource to value
+        Keyword arguments:
+        resources -- list of resources to read
+        object_ -- the highest level object containing the instance and resources
+        instance -- the instance of these resources under the object
+        timeout -- time to do rest command before timing out
+        '''
+        # group the resources by the instance they belong to
+        requested = {}
+        with self.__span('readMany', 'resolve'):
+            for resource in resources:
+                res_id = self.__searchDictionary(resource, object_, instance)
+                inst_path, res = res_id.rsplit('/', 1)
+                requested.setdefault(inst_path, []).append((resource, res))
+        values = {}
+        for inst_path, members in requested.items():
+            content = self.__readPath('readMany', inst_path, timeout)
+            inst_values = {str(res['id']): self.__resourceValue(res) for res in content.get('resources', [])}
+            for resource, res in members:
+                if res not in inst_values:
+                    raise KeyError("resource " + resource +
+                                   " is not available for reading")
+                values[resource] = inst_values[res]
+        return values
+
+    @instrumented('write')
     def write(self, text, resource, object_=None, instance=None, timeout=TIMEOUT):
         '''writes text to selected resource on the leshan server
         Keyword arguments:
@@ -105,29 +660,35 @@ class Client():
         timeout -- time to do rest command before timing out
         '''
         # search through dictionary to find the resource id to call
-        res_id = self.__searchDictionary(resource, object_, instance)
+        with self.__span('write', 'resolve'):
+            res_id = self.__searchDictionary(resource, object_, instance)
+        # forget the cached value even if the write fails as the device state is unknown
+        if self.cache is not None:
+            self.cache.invalidate(self.client, res_id)
         # make request
-        r = requests.put(self.requestUrl + res_id,
-                         json={'id': res_id.split("/")[-1], 'value': text}, timeout=timeout)
-        # raise error if http request fails
-        r.raise_for_status()
+        self.__send('write', 'PUT', res_id, timeout, json={'id': res_id.split("/")[-1], 'value': text})
 
-    def observe(self, resource, object_=None, instance=None, timeout=TIMEOUT):
+    @instrumented('observe')
+    def observe(self, resource, object_=None, instance=None, timeout=TIMEOUT, stream=None, callback=None):
         '''Observe the selected resource on the leshan server
         Keyword arguments:
         resource -- resource you want to observe
         object_ -- the highest level object containing the instance and resource
         instance -- the instance of this resource under the object
         timeout -- time to do rest command before timing out
+        stream -- EventStream to deliver the notifications of this resource on, usually Server.events()
+        callback -- function called with each Notification of this resource received on stream
         '''
         # search through dictionary to find the resource id to call
-        res_id = self.__searchDictionary(resource, object_, instance)
+        with self.__span('observe', 'resolve'):
+            res_id = self.__searchDictionary(resource, object_, instance)
+        # subscribe before the observation starts so the first notification is not missed
+        if stream is not None:
+            stream.subscribe(self.client, res_id, callback)
         # make request
-        r = requests.post(self.requestUrl +
-                          res_id + '/observe', timeout=timeout)
-        # raise error if http request fails
-        r.raise_for_status()
+        self.__send('observe', 'POST', res_id + '/observe', timeout)
 
+    @instrumented('discover')
     def discover(self, resource, object_=None, instance=None, timeout=TIMEOUT):
         '''discover the selected resource on the leshan server
         Keyword arguments:
@@ -137,13 +698,12 @@ class Client():
         timeout -- time to do rest command before timing out
         '''
         # search through dictionary to find the resource id to call
-        res_id = self.__searchDictionary(resource, object_, instance)
+        with self.__span('discover', 'resolve'):
+            res_id = self.__searchDictionary(resource, object_, instance)
         # make request
-        r = requests.get(self.requestUrl +
-                         res_id + '/discover', timeout=timeout)
-        # raise error if request fails
-        r.raise_for_status()
+        self.__send('discover', 'GET', res_id + '/discover', timeout)
 
+    @instrumented('execute')
     def execute(self, resource, object_=None, instance=None, timeout=TIMEOUT):
         '''Execute the selected resource on the leshan server
         Keyword arguments:
@@ -153,12 +713,15 @@ class Client():
         timeout -- time to do rest command before timing out
         '''
         # search through dictionary to find the resource id to call
-        res_id = self.__searchDictionary(resource, object_, instance)
+        with self.__span('execute', 'resolve'):
+            res_id = self.__searchDictionary(resource, object_, instance)
+        # executing a resource may change any resource of its instance
+        if self.cache is not None:
+            self.cache.invalidate(self.client, res_id.rsplit('/', 1)[0])
         # make request
-        r = requests.post(self.requestUrl + res_id, timeout=timeout)
-        # raise error if request fails
-        r.raise_for_status()
+        self.__send('execute', 'POST', res_id, timeout)
 
+    @instrumented('delete')
     def delete(self, resource, object_=None, instance=None, timeout=TIMEOUT):
         '''delete the given resource on the leshan server.
         Keyword arguments:
@@ -168,11 +731,12 @@ class Client():
         timeout -- time to do rest command before timing out
         '''
         # search through dictionary to find the resource id to call
-        res_id = self.__searchDictionary(resource, object_, instance)
+        with self.__span('delete', 'resolve'):
+            res_id = self.__searchDictionary(resource, object_, instance)
+        if self.cache is not None:
+            self.cache.invalidate(self.client, res_id)
         # make request
-        r = requests.delete(self.requestUrl + res_id, timeout=timeout)
-        # raise error if request fails
-        r.raise_for_status()
+        self.__send('delete', 'DELETE', res_id, timeout)
 
     def assertread(self,assertValue,resource,object_=None,instance=None,timeout=TIMEOUT):
         '''check if output from read is equal to input string. Exists for testing ease in robot-framework.
@@ -185,6 +749,161 @@ class Client():
         '''
         assert(assertValue==self.read(resource,object_,instance,timeout))
 
+    def __send(self, operation, method, path, timeout, **kwargs):
+        '''helper method of the operations that makes the request of path on this client and returns the response
+        Keyword arguments:
+        operation -- name of the operation the request is recorded under
+        method -- http method
+        path -- path of the request under the client eg. /3/0/1
+        timeout -- time to do rest command before timing out. With a LatencyTracker the default TIMEOUT is replaced
+                   by the timeout the tracker sets from the response times of this client.
+        '''
+        with self.__span(operation, 'request'):
+            if self.latency is None:
+                return self.__request(method, path, timeout, **kwargs)
+            # a timeout given by the caller is kept as is
+            if isinstance(timeout, DefaultTimeout):
+                timeout = self.latency.timeout(self.client, timeout)
+            # only requests that can be repeated without side effects are hedged
+            delay = self.latency.hedgeDelay(self.client) if method == 'GET' else None
+            if delay is None:
+                return self.__request(method, path, timeout, **kwargs)
+            return self.__hedge(operation, path, timeout, delay)
+
+    def __request(self, method, path, timeout, **kwargs):
+        '''helper method of __send that makes one request and records its response time with the latency tracker'''
+        start = time.monotonic()
+        try:
+            r = self.session.request(method, self.requestUrl + path, timeout=timeout, **kwargs)
+        except requests.exceptions.Timeout:
+            # counted apart from the response times so one timeout does not lengthen every later timeout
+            if self.latency is not None:
+                self.latency.recordTimeout(self.client)
+            raise
+        if self.latency is not None:
+            self.latency.record(self.client, time.monotonic() - start)
+        # raise error if http request fails
+        r.raise_for_status()
+        return r
+
+    def __hedge(self, operation, path, timeout, delay):
+        '''helper method of __send that reads path and sends a second read if the first has not answered after delay.
+        Returns the first successful response, the slower request finishes in the background.
+        Keyword arguments:
+        operation -- name of the operation the hedged requests are counted under
+        path -- path of the request under the client eg. /3/0/1
+        timeout -- time to do rest command before timing out
+        delay -- seconds to wait for the first request before sending the second
+        '''
+        first = self.latency.submit(self.__request, 'GET', path, timeout)
+        if first is None:
+            # every hedging worker is busy, so the request is sent from this thread without a hedge
+            return self.__request('GET', path, timeout)
+        pending = {first}
+        # the first request started right away on a free worker, so the delay only counts its response time
+        if not wait(pending, timeout=delay).done:
+            second = self.latency.submit(self.__request, 'GET', path, timeout)
+            if second is not None:
+                pending.add(second)
+                if self.metrics is not None:
+                    self.metrics.count(operation + '_hedged', self.client)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    if attempt is not first and self.metrics is not None:
+                        self.metrics.count(operation + '_hedge_wins', self.client)
+                    return attempt.result()
+                error = attempt.exception()
+        raise error
+
+    def __span(self, operation, phase):
+        '''helper method that returns the span timing phase of operation'''
+        if self.metrics is None:
+            return NULL_SPAN
+        return self.metrics.span(operation, phase, self.client)
+
+    def __readPath(self, operation, path, timeout):
+        '''helper method of the instance and object reads that returns the content read from path
+        Keyword arguments:
+        operation -- name of the operation the request is recorded under
+        path -- object or instance path to read eg. /3/0
+        timeout -- time to do rest command before timing out
+        '''
+        r = self.__send(operation, 'GET', path, timeout)
+        with self.__span(operation, 'decode'):
+            rDict = json.loads(r.text)
+        try:
+            return rDict['content']
+        except KeyError:
+            raise KeyError("path " + path + " is not available for reading")
+
+    def __decodeInstance(self, inst_path, content):
+        '''helper method of the instance and object reads that converts the resources of an instance into a dictionary of resource name to value.
+        Resources missing from page_objects are keyed on their id.
+        Keyword arguments:
+        inst_path -- path of the instance eg. /3/0
+        content -- instance content returned by the leshan server
+        '''
+        values = {}
+        for res in content.get('resources', []):
+            res_path = inst_path + '/' + str(res['id'])
+            values[self.__model.names.get(res_path, str(res['id']))] = self.__resourceValue(res)
+        return values
+
+    def __resourceValue(self, res):
+        '''returns the value of a single resource or the dictionary of values of a multiple instance resource'''
+        if 'values' in res:
+            return res['values']
+        return res.get('value')
+
+    def __instancePath(self, object_, instance):
+        '''returns the path of the instance of object_ eg. /3/0
+        Keyword arguments:
+        object_ -- the highest level object containing the instance
+        instance -- the instance of the object
+        '''
+        if self.__model is None:
+            self.load()
+        inst_path = self.__model.instancePaths.get((object_.lower(), str(instance)))
+        if inst_path is None:
+            raise LookupError("Could not find instance " + str(instance) + " of object " + object_)
+        return inst_path
+
+    @property
+    def page_objects(self):
+        '''nested dictionary of object>instance>resource giving the path of each resource. It is shared by
+        every client with the same resources and cannot be changed, assign a new dictionary instead.'''
+        if self.__model is None:
+            self.load()
+        return self.__model.page_objects
+
+    @page_objects.setter
+    def page_objects(self, object_dict):
+        # clients with the same resources share one model, which holds the lookup index and resolved names
+        self.__model = ResourceModel.intern(object_dict)
+
+    def load(self):
+        '''load the resources of this client from the client cache, models or html if they are not loaded yet.
+        Called by the first operation so it is only needed to load them ahead of time.'''
+        with self.__loadLock:
+            # another thread may have loaded them while we waited
+            if self.__model is None:
+                self.page_objects = self.__getSource()
+                # the registration is only needed to load the resources
+                self.links = None
+        return self
+
+    def resolve(self, resource, object_=None, instance=None):
+        '''returns the path of the resource eg. /3/0/1, searched for the same way as every other operation
+        Keyword arguments:
+        resource -- the resource to find
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        '''
+        return self.__searchDictionary(resource, object_, instance)
+
     def __searchDictionary(self, resource, object_=None, instance=None):
         '''search the page_objects dictionary for a match on the selected resource
         Keyword arguments:
@@ -192,123 +911,121 @@ class Client():
         object_ -- the highest level object containing the instance and resource
         instance -- the instance of this resource under the object
         '''
-        matches = []
-        #TODO THIS IS BAD CODING. PUT THIS INTO EACH A SEPARATE METHOD!
-        if object_ is None:
-            if instance is None:
-                # if user did not supply object or instance then we check all objects and instances.
-                for obj_key in self.page_objects.keys():
-                    for inst_key in self.page_objects[obj_key].keys():
-                        matches = self.__searchInstances(
-                            resource, obj_key, inst_key, matches)
-            else:
-                # if user supplied instance but not object then for each object we search entered instance
-                # convert to string if user entered an int
-                instance = str(instance)
-                for obj_key in self.page_objects.keys():
-                    matches = self.__searchInstances(
-                        resource, obj_key, instance, matches)
-        else:
-            try:
-                # check if the user swapped object and instance
-                int(object_)
-                # if so then we swap object and instance to be consistent
-                temp = str(object_)
-                object_ = str(instance.lower())
-                instance = temp
-                # user didnt enter an actual object so we must loop through each object and then search for supplied instance
-                if object_ == 'None':
-                    for obj_key in self.page_objects.keys():
-                        matches = self.__searchInstances(
-                            resource, obj_key, instance, matches)
-                else:
-                    matches = self.__searchInstances(
-                        resource, object_, instance, matches)
-            except ValueError:
-                # the general case if the user enters in variables in the intended order
-                # convert input object to lower case
-                object_ = object_.lower()
-                if instance is None:
-                    # if user supplied object but not instance we search through all instances in supplied object
-                    for inst_key in self.page_objects[object_].keys():
-                        matches = self.__searchInstances(
-                            resource, object_, inst_key, matches)
-                else:
-                    # the simplest case where the user entered both an instance and an object in the correct order.
-                    # convert to instance number to a string.
-                    instance = str(instance)
-                    matches = self.__searchInstances(
-                        resource, object_, instance, matches)
-
-        if len(matches) == 0:
-            raise LookupError(
-                "Could not find a resource that satisfies conditions")
-
-        return matches[0]
+        if self.__model is None:
+            self.load()
+        object_, instance = self.__normalizeKeys(object_, instance)
+        key = (resource.lower(), object_, instance)
+        resolved = self.__model.resolved
+        res_id = resolved.get(key)
+        if res_id is None:
+            res_id = self.__searchIndex(resource, object_, instance)
+            resolved[key] = res_id
+        return res_id
 
-    def __searchInstances(self, resource, object_, instance, matches):
-        '''helper method of searchDictionary() that checks each resource in the supplied object_ and instance and returns the match.
+    def __normalizeKeys(self, object_, instance):
+        '''helper method of searchDictionary() that returns the object and instance as they are keyed in page_objects.
+        None means the user did not restrict the search to an object or instance.
         Keyword arguments:
-        resource -- the resource to match
         object_ -- the highest level object containing the instance and resource
         instance -- the instance of this resource under the object
         '''
-        # if this object doesnt have an instance we return to sender
-        if self.page_objects.get(object_) is None or self.page_objects.get(object_).get(instance) is None:
-            return matches
+        if object_ is None:
+            return None, None if instance is None else str(instance)
+        try:
+            # check if the user swapped object and instance
+            int(object_)
+        except ValueError:
+            # the general case if the user enters in variables in the intended order
+            return object_.lower(), None if instance is None else str(instance)
+        # if so then we swap object and instance to be consistent
+        return None if instance is None else str(instance).lower(), str(object_)
 
-        for res_key, res_val in self.page_objects[object_][instance].items():
-            if res_key.lower() == resource.lower():
-                matches.append(res_val)
-            # throw error if we have found multiple resources with the conditions
-            if len(matches) > 1:
-                raise LookupError("Multiple resources were found that satisfy conditions to match resource: " +
-                                  resource + ". Please specify instance number or object name")
+    def __searchIndex(self, resource, object_, instance):
+        '''helper method of searchDictionary() that finds the single resource in the index matching the conditions
+        Keyword arguments:
+        resource -- the resource to match
+        object_ -- the object key the resource must be under or None for any object
+        instance -- the instance key the resource must be under or None for any instance
+        '''
+        name = resource.lower()
+        if object_ is None and instance is None:
+            unique = self.__model.unique.get(name)
+            if unique is not None:
+                return unique
+        elif object_ is not None and instance is None and object_ not in self.__model.page_objects:
+            # searching the instances of an object that does not exist
+            raise KeyError(object_)
 
-        return matches
+        matches = [path for obj_key, inst_key, path in self.__model.index.get(name, ())
+                   if (object_ is None or obj_key == object_) and (instance is None or inst_key == instance)]
+        if len(matches) == 0:
+            raise LookupError(
+                "Could not find a resource that satisfies conditions")
+        # throw error if we have found multiple resources with the conditions
+        if len(matches) > 1:
+            raise LookupError("Multiple resources were found that satisfy conditions to match resource: " +
+                              resource + ". Please specify instance number or object name")
+        return matches[0]
 
+    @instrumented('load')
     def __getSource(self):
-        '''returns the source from a file if available or the html if not'''
+        '''returns the source from the client cache if available or the html if not'''
+        store = self.store if self.store is not None else defaultStore()
+        # the models build the client without the server, so its registration is only used when it was given
+        if self.links is None and self.models is None:
+            self.links = self.__getObjectLinks()
+        # without the registration the cached client cannot be checked so it is trusted
+        signature = None if self.links is None else linkSignature(self.links)
         if not self.refresh:
             # check if we have a cached dictionary of this client
-            for file_name in os.listdir(os.path.join(DIR_PATH,'cached_clients')):
-                if file_name == self.client+'.json':
-                    file_path = os.path.join(DIR_PATH,'cached_clients',file_name)
-                    return json.load(open(file_path))
+            object_dict = store.get(self.client, signature)
+            if self.metrics is not None:
+                self.metrics.count('client_cache_miss' if object_dict is None else 'client_cache_hit', self.client)
+            if object_dict is not None:
+                return object_dict
         # if we dont then we have to do the more time consuming option of scraping the html
-        if self.models is None:
-            return self.__getSourceFromHTML()
-        else:
+        if self.models is not None:
             return self.__getSourceFromXML()
-    
+        elif self.discovery == 'json':
+            object_dict = self.__getSourceFromJSON()
+        else:
+            object_dict = self.__getSourceFromHTML()
+        # cache the page_objects of this client so we dont have to connect to its server again to fetch html
+        store.put(self.client, object_dict, signature)
+        return object_dict
+
+    def __getObjectLinks(self, timeout=TIMEOUT):
+        '''returns the objectLinks of the client registration eg. /3/0 or None if the server cannot be reached'''
+        try:
+            r = self.session.get(self.requestUrl, timeout=timeout)
+            r.raise_for_status()
+            return json.loads(r.text).get('objectLinks', [])
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def __getSourceFromJSON(self, timeout=TIMEOUT):
+        '''returns the dictionary of page_objects from the registration and object models served by the leshan REST API'''
+        # the registration lists the object instances of the client eg. /3/0
+        if self.links is None:
+            r = self.session.get(self.requestUrl, timeout=timeout)
+            r.raise_for_status()
+            self.links = json.loads(r.text).get('objectLinks', [])
+        # the object models give the names of each object and resource
+        r = self.session.get(self.requestUrl.replace('/clients/', '/objectspecs/'), timeout=timeout)
+        r.raise_for_status()
+        specs = {str(spec['id']): spec for spec in json.loads(r.text)}
+        object_dict = buildPageObjects(self.links, specs)
+        # raise error if parsing was not successful
+        if len(object_dict) == 0:
+            raise IOError("Registration was not rendered into a dictionary")
+        return object_dict
+
     def __getSourceFromXML(self):
         '''returns the source from the xml models folder which shows the server side resources'''
-        object_dict = {}
-        for filename in os.listdir(self.models):
-            if filename.endswith(".xml"): #ignore all files in models folder that are not xmls
-                # get the root of the xml document
-                root = ET.parse(os.path.join(self.models, filename)).getroot()
-
-                object_name = root.findall('Object')[0].getchildren()[0].text
-                object_id = root.findall('Object')[0].getchildren()[2].text
-
-                instance_dict={}
-                instance_id = '0'  #right now only one instance can be handled when using the xml parser.
-
-                 # iterate through root, and create the dictionary of resources
-                resource_dict = {}
-                for resource in root.findall('Object/Resources/Item'):
-                    resource_name = resource.getchildren()[0].text
-                    resource_id = resource.attrib['ID'] 
-                     #the resource_id given on the xml is different than the resource_id given by the html scrape so we convert this resource_id to be consistent
-                    resource_dict[resource_name] = '/' + object_id + '/' + instance_id + '/' + resource_id
-
-                # form the final outputDict
-                instance_dict[instance_id] = resource_dict #as we are only parsing for one instance currently we do not need a for loop like in the html scape
-                object_dict[object_name] = instance_dict
+        registry = self.registry if self.registry is not None else MODEL_REGISTRY
+        # without the registration a single instance of every model is assumed
+        return registry.resourceMap(self.models, self.links)
 
-        return object_dict
-        
     def __getSourceFromHTML(self):
         '''returns the dictionary of page_objects from the html of the client page'''
         # launch headless chrome
@@ -316,15 +1033,12 @@ class Client():
         # get the raw html from the webpage
         encoded_source = self.__fetchHTML(driver)
         # parse the url into json
-        object_dict = self.__parseHTML(
-            BeautifulSoup(encoded_source, 'html.parser'))
+        object_dict = parsePage(encoded_source.decode('utf-8'))
         # raise error if parsing was not successful
         if len(object_dict) == 0:
             raise IOError("URL was not rendered into a dictionary")
         # convert object_dict to lowercase
         object_dict = {k.lower(): v for k, v in object_dict.items()}
-        # cache the page_objects of this client so we dont have to connect to its server again to fetch html
-        self.__cacheClient(object_dict)
         return object_dict
 
     def __fetchHTML(self, driver):
@@ -332,6 +1046,10 @@ class Client():
         Keyword arguments:
         driver -- selenium webdriver object 
         '''
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait  # available since 2.4.0
+        # available since 2.26.0
+        from selenium.webdriver.support import expected_conditions as EC
         driver.get(self.url)
         # wait until the dom fully renders. We can check that we can find the object-name
         WebDriverWait(driver, 10).until(
@@ -343,59 +1061,883 @@ class Client():
 
     def __setBrowser(self):
         '''helper method of getSourceFromHTML() that configures the browser'''
+        from selenium import webdriver
         options = webdriver.ChromeOptions()
         options.add_argument('headless')
         options.add_argument('disable-gpu')
         return webdriver.Chrome(chrome_options=options)
 
-    def __cacheClient(self, object_dict):
-        '''cache the page_object dictionary of the client so we don't need to scrape the html on future querries
-        Keyword arguments:
-        object_dict -- dictionary of page_objects that are sent to output file
-        '''
-        # convert the dictionary to json string
-        page_objects = json.dumps(object_dict)
-        # open and write the json string to file
-        file_path = os.path.join(DIR_PATH,'cached_clients',self.client +'.json')
-        f = open(file_path, 'w')
-        f.write(page_objects)
-
-    def __parseHTML(self, page_source):
-        '''parses the url of the leshan client webpage into a dictionary containing each object, instance and resource.
-        Keyword arguments:
-        page_source -- raw html to parse and return page_objects dictionary
-        '''
-        object_dict = {}
-        # the Leshan html is a tree structure with elements given as objects>instances>resources
-        objects = page_source.find_all(
-            attrs={'ng-repeat': 'object in objects'})
-        # for each object we find all elements that contain the instances
-        for object_ in objects:
-            instances = object_.find_all(
-                attrs={'ng-repeat': 'instance in object.instances'})
-            instance_dict = {}
-            # for each instance element we find we find all resources attached to that resource
-            for i in range(len(instances)):
-                resources = instances[i].find_all(
-                    attrs={'ng-repeat': 'resource in instance.resources'})
-                resource_dict = {}
-                # find the resource_name and id and put that into the dictionary
-                for resource in resources:
-                    resource_name = resource.find(
-                        class_='resource-name').text.strip()
-                    resource_id = resource.find(
-                        'button').attrs['tooltip-html-unsafe'].split('>')[1]
-                    resource_dict[resource_name] = resource_id
-                instance_dict[i] = resource_dict
-            # we put all the resource objects into a nested dictionary of object>instance>resources
-            object_name = object_.find(class_='object-name').text.strip()
-            object_dict[object_name] = instance_dict
-
-        return object_dict
-
     def printPageObjects(self):
         '''helper method to pretty print the page_objects for debugging'''
         print(json.dumps(self.page_objects, indent=4, sort_keys=True))
     
     def __str__(self):
-        return self.client
\ No newline at end of file
+        return self.client
+
+Notification = namedtuple('Notification', ['endpoint', 'path', 'value', 'content'])
+
+
+class EventStream():
+    '''Subscribes to the server-sent event stream of the leshan server and delivers the observe notifications
+    of the subscribed endpoints and resources. One stream serves the subscriptions of every client of the server.'''
+
+    def __init__(self, url, session=None, reconnect_delay=RECONNECT_DELAY, cache=None):
+        '''sets the information required to connect to the event stream
+        Keyword arguments:
+        url -- url of the leshan server
+        session -- requests session to use. If None a pooled session is created.
+        reconnect_delay -- seconds to wait before reopening the stream when it is dropped
+        cache -- ValueCache updated with every notification received, subscribed to or not
+        '''
+        # the event stream is served next to the api eg. https://leshan.eclipse.org/event
+        self.url = url.split('/#')[0].split('/api/')[0].rstrip('/') + '/event'
+        self.session = session if session is not None else createSession()
+        self.reconnect_delay = reconnect_delay
+        self.cache = cache
+        self.subscriptions = {}  # endpoint to a dictionary of subscribed path to callbacks
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__response = None
+        self.__thread = None
+
+    def subscribe(self, endpoint, path=None, callback=None):
+        '''deliver the notifications of path on endpoint
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        path -- resource, instance or object path eg. /3/0/1. If None every notification of the endpoint is delivered.
+        callback -- function called with each matching Notification. Exceptions it raises are logged and ignored.
+        '''
+        with self.__lock:
+            # copy on write so the stream can read the subscriptions without holding the lock
+            subscriptions = {ep: dict(paths) for ep, paths in self.subscriptions.items()}
+            callbacks = subscriptions.setdefault(endpoint, {}).setdefault(path, [])
+            subscriptions[endpoint][path] = callbacks + ([callback] if callback is not None else [])
+            self.subscriptions = subscriptions
+
+    def unsubscribe(self, endpoint, path=None):
+        '''stop delivering the notifications of path on endpoint
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        path -- path given to subscribe(). If None every subscription of the endpoint is removed.
+        '''
+        with self.__lock:
+            subscriptions = {ep: dict(paths) for ep, paths in self.subscriptions.items()}
+            if path is None:
+                subscriptions.pop(endpoint, None)
+            else:
+                subscriptions.get(endpoint, {}).pop(path, None)
+            self.subscriptions = subscriptions
+
+    def notifications(self):
+        '''generator that yields each Notification matching a subscription and calls the callbacks subscribed to it.
+        The stream is reopened whenever the connection drops, until stop() is called.'''
+        self.__stopped.clear()
+        while not self.__stopped.is_set():
+            try:
+                for event, data in self.__events():
+                    if event != 'NOTIFICATION':
+                        continue
+                    event = json.loads(data)
+                    self.__updateCache(event)
+                    notification = self.__match(event)
+                    if notification is not None:
+                        yield notification
+            except (requests.exceptions.RequestException, ValueError):
+                # connection dropped or the event was cut off. Reconnect after a delay.
+                pass
+            self.__stopped.wait(self.reconnect_delay)
+
+    def run(self):
+        '''deliver notifications to the subscribed callbacks until stop() is called'''
+        for _ in self.notifications():
+            pass
+
+    def start(self):
+        '''deliver notifications to the subscribed callbacks from a background thread'''
+        if self.__thread is None or not self.__thread.is_alive():
+            self.__thread = threading.Thread(target=self.run, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        '''stop delivering notifications and close the stream'''
+        self.__stopped.set()
+        if self.__response is not None:
+            self.__response.close()
+
+    def __events(self):
+        '''helper method of notifications() that yields the (event, data) of each server-sent event of one connection'''
+        # no read timeout as the server may be quiet for a long time between notifications
+        r = self.session.get(self.url, stream=True, timeout=(TIMEOUT, None),
+                             headers={'Accept': 'text/event-stream'})
+        r.raise_for_status()
+        self.__response = r
+        try:
+            event, data = 'message', []
+            for line in r.iter_lines(decode_unicode=True):
+                if self.__stopped.is_set():
+                    return
+                if not line:
+                    # a blank line ends the event
+                    if data:
+                        yield event, '\n'.join(data)
+                    event, data = 'message', []
+                elif line.startswith('event:'):
+                    event = line[6:].strip()
+                elif line.startswith('data:'):
+                    data.append(line[5:].strip())
+        finally:
+            r.close()
+            self.__response = None
+
+    def __updateCache(self, event):
+        '''helper method of notifications() that stores the value of a resource notification in the cache
+        and forgets the cached resources of an object or instance notification
+        Keyword arguments:
+        event -- decoded data of the NOTIFICATION event
+        '''
+        if self.cache is None or 'ep' not in event or 'res' not in event:
+            return
+        content = event.get('val') or {}
+        if 'value' in content:
+            self.cache.put(event['ep'], event['res'], content['value'])
+        else:
+            self.cache.invalidate(event['ep'], event['res'])
+
+    def __match(self, event):
+        '''helper method of notifications() that returns the Notification of event if it is subscribed to, otherwise None
+        Keyword arguments:
+        event -- decoded data of the NOTIFICATION event
+        '''
+        paths = self.subscriptions.get(event.get('ep'))
+        if paths is None:
+            return None
+        path = event.get('res', '')
+        callbacks = []
+        matched = False
+        for sub_path, sub_callbacks in paths.items():
+            # a subscription to an object or instance also matches the resources under it
+            if sub_path is None or path == sub_path or path.startswith(sub_path.rstrip('/') + '/'):
+                matched = True
+                callbacks.extend(sub_callbacks)
+        if not matched:
+            return None
+        content = event.get('val') or {}
+        if 'value' in content:
+            value = content['value']
+        elif 'values' in content:
+            value = content['values']
+        else:
+            value = content
+        notification = Notification(event['ep'], path, value, content)
+        for callback in callbacks:
+            # a failing callback must not drop the stream or the notifications of the other subscribers
+            try:
+                callback(notification)
+            except Exception:
+                log.exception("callback %r failed on the notification of %s on %s", callback, path, event['ep'])
+        return notification
+
+
+class ValueCache():
+    '''Least recently used cache of the resource values read from clients. Values expire after ttl seconds.
+    One cache can be shared by every client of a server as values are keyed on endpoint and path.'''
+
+    def __init__(self, ttl=CACHE_TTL, maxsize=CACHE_SIZE):
+        '''sets the limits of the cache
+        Keyword arguments:
+        ttl -- seconds a value is served from the cache after it was read
+        maxsize -- maximum number of values held. The least recently used value is dropped when full.
+        '''
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__values = OrderedDict()  # (endpoint, path) to (expiry, value) in least recently used order
+        self.__paths = {}  # endpoint to the set of its cached paths for invalidating an endpoint without a full scan
+        self.__lock = threading.Lock()
+
+    def get(self, endpoint, path):
+        '''returns a tuple (hit, value) of the cached value of path on endpoint
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        path -- resource path eg. /3/0/1
+        '''
+        key = (endpoint, path)
+        with self.__lock:
+            entry = self.__values.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self.__remove(key)
+                self.misses += 1
+                return False, None
+            self.__values.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, endpoint, path, value):
+        '''store the value of path on endpoint
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        path -- resource path eg. /3/0/1
+        value -- value of the resource
+        '''
+        key = (endpoint, path)
+        with self.__lock:
+            self.__values[key] = (time.monotonic() + self.ttl, value)
+            self.__values.move_to_end(key)
+            self.__paths.setdefault(endpoint, set()).add(path)
+            while len(self.__values) > self.maxsize:
+                self.__remove(next(iter(self.__values)))
+
+    def invalidate(self, endpoint, path=None):
+        '''forget the cached values of path and the resources under it on endpoint
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        path -- resource, instance or object path eg. /3/0. If None every value of the endpoint is forgotten.
+        '''
+        with self.__lock:
+            prefix = None if path is None else path.rstrip('/') + '/'
+            for cached in list(self.__paths.get(endpoint, ())):
+                if prefix is None or cached == path or cached.startswith(prefix):
+                    self.__remove((endpoint, cached))
+
+    def clear(self):
+        '''forget every cached value'''
+        with self.__lock:
+            self.__values.clear()
+            self.__paths.clear()
+
+    def __remove(self, key):
+        '''helper method that drops key from the cache. The lock must be held.'''
+        del self.__values[key]
+        paths = self.__paths[key[0]]
+        paths.discard(key[1])
+        if not paths:
+            del self.__paths[key[0]]
+
+    def __len__(self):
+        return len(self.__values)
+
+
+class LatencyTracker():
+    '''Keeps the recent response times of each endpoint and sets the timeout of its requests from them, so fast
+    devices fail fast and slow devices are given the time they need. Reads can also be hedged: when the first request
+    has not answered after a high percentile of the response times a second one is sent and the first answer is used.
+    Timed out requests are counted apart from the response times: after a timeout the next request of the endpoint
+    is given at least the default timeout, never more, so an unreachable device does not hold a worker any longer
+    than with fixed timeouts. One tracker can be shared by every client of a server as response times are kept per
+    endpoint.'''
+
+    def __init__(self, window=LATENCY_WINDOW, percentile=0.99, multiplier=2, min_timeout=0.5, max_timeout=60,
+                 min_samples=10, hedge=None, hedge_workers=4 * MAX_WORKERS):
+        '''sets how timeouts and hedging follow the response times
+        Keyword arguments:
+        window -- number of recent response times kept for each endpoint
+        percentile -- percentile of the response times the timeout is based on
+        multiplier -- the timeout is the percentile response time times multiplier
+        min_timeout -- shortest timeout in seconds
+        max_timeout -- longest timeout in seconds
+        min_samples -- response times of an endpoint needed before its timeout adapts. Until then the timeout given
+                       to the operation is used.
+        hedge -- percentile of the response times after which a read or discover is sent again, eg. 0.95.
+                 If None requests are not hedged.
+        hedge_workers -- maximum number of requests of hedged operations in flight at once. Reads beyond it are
+                         sent without a hedge.
+        '''
+        self.window = window
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.hedge = hedge
+        self.hedge_workers = hedge_workers
+        self.__times = {}  # endpoint to deque of its recent response times in seconds
+        self.__timeouts = {}  # endpoint to the number of its requests that timed out since its last response
+        self.__executor = None  # runs the requests of hedged operations, created on first use
+        self.__running = 0  # requests submitted to the executor that have not finished
+        self.__lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        '''record that a request to endpoint was answered after seconds'''
+        with self.__lock:
+            times = self.__times.get(endpoint)
+            if times is None:
+                times = self.__times[endpoint] = deque(maxlen=self.window)
+            times.append(seconds)
+            self.__timeouts.pop(endpoint, None)
+
+    def recordTimeout(self, endpoint):
+        '''record that a request to endpoint timed out'''
+        with self.__lock:
+            self.__timeouts[endpoint] = self.__timeouts.get(endpoint, 0) + 1
+
+    def timeouts(self, endpoint):
+        '''returns the number of requests to endpoint that timed out since it last answered'''
+        with self.__lock:
+            return self.__timeouts.get(endpoint, 0)
+
+    def responseTime(self, endpoint, q):
+        '''returns the q percentile of the recent response times of endpoint, or None if there are too few of them'''
+        with self.__lock:
+            times = self.__times.get(endpoint)
+            if times is None or len(times) < self.min_samples:
+                return None
+            times = sorted(times)
+        return times[min(len(times) - 1, int(q * len(times)))]
+
+    def timeout(self, endpoint, default=TIMEOUT):
+        '''returns the timeout of the next request to endpoint
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        default -- timeout used until there are enough response times of endpoint, and the least timeout after
+                   a request to endpoint timed out
+        '''
+        seconds = self.responseTime(endpoint, self.percentile)
+        if seconds is None:
+            return default
+        timeout = min(self.max_timeout, max(self.min_timeout, seconds * self.multiplier))
+        if self.timeouts(endpoint):
+            # the device may have become slower than its response times show
+            return max(default, timeout)
+        return timeout
+
+    def hedgeDelay(self, endpoint):
+        '''returns the seconds to wait for a read of endpoint before sending it again, or None to not hedge it'''
+        if self.hedge is None:
+            return None
+        return self.responseTime(endpoint, self.hedge)
+
+    def submit(self, function, *args, **kwargs):
+        '''run function in the background for a hedged operation and return its future. Returns None instead of
+        queueing it when hedge_workers requests are already in flight, as time spent queued would look like a slow
+        response and hedge every request.'''
+        with self.__lock:
+            if self.__running >= self.hedge_workers:
+                return None
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.hedge_workers)
+            self.__running += 1
+            executor = self.__executor
+        return executor.submit(self.__run, function, args, kwargs)
+
+    def __run(self, function, args, kwargs):
+        '''helper method of submit that runs function on a worker and frees the worker afterwards'''
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with self.__lock:
+                self.__running -= 1
+
+    def forget(self, endpoint=None):
+        '''forget the response times of endpoint, or of every endpoint if None'''
+        with self.__lock:
+            if endpoint is None:
+                self.__times.clear()
+                self.__timeouts.clear()
+            else:
+                self.__times.pop(endpoint, None)
+                self.__timeouts.pop(endpoint, None)
+
+    def close(self):
+        '''stop the threads of hedged operations once their requests finish'''
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class ClientStore():
+    '''Interface of the stores that cache the page_objects of clients so they are not scraped again.
+    Subclass it and pass an instance as store= to use another backend.'''
+
+    def get(self, endpoint, signature=None):
+        '''returns the cached page_objects of endpoint or None if it is not cached or stale
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        signature -- linkSignature() of the current registration. If None the cached entry is not checked.
+        '''
+        raise NotImplementedError
+
+    def put(self, endpoint, page_objects, signature=None):
+        '''cache the page_objects of endpoint
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        page_objects -- dictionary of object>instance>resources of the client
+        signature -- linkSignature() of the registration the page_objects were built from
+        '''
+        raise NotImplementedError
+
+    def delete(self, endpoint):
+        '''forget the cached page_objects of endpoint'''
+        raise NotImplementedError
+
+
+class JsonClientStore(ClientStore):
+    '''Caches each client in its own json file, like the cached_clients folder shipped with this library.
+    Json files do not record the registration so they are never considered stale.'''
+
+    def __init__(self, folder=os.path.join(DIR_PATH, 'cached_clients'), readonly=False):
+        '''sets the folder of the json files
+        Keyword arguments:
+        folder -- folder holding one <endpoint>.json file per client
+        readonly -- ignore put() and delete(), for folders that cannot be written to
+        '''
+        self.folder = folder
+        self.readonly = readonly
+
+    def get(self, endpoint, signature=None):
+        file_path = os.path.join(self.folder, endpoint + '.json')
+        if not os.path.isfile(file_path):
+            return None
+        with open(file_path) as f:
+            return json.load(f)
+
+    def put(self, endpoint, page_objects, signature=None):
+        if self.readonly:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        file_path = os.path.join(self.folder, endpoint + '.json')
+        # write to a temporary file and swap it in so a reader never sees a partial file
+        temp_path = file_path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(page_objects, f)
+        os.replace(temp_path, file_path)
+
+    def delete(self, endpoint):
+        if self.readonly:
+            return
+        file_path = os.path.join(self.folder, endpoint + '.json')
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+
+
+class SqliteClientStore(ClientStore):
+    '''Caches every client in a single sqlite database indexed on endpoint. Writes are atomic and safe from
+    many threads and processes. Entries built from different object links than the current registration are stale.
+    When the database cannot be opened or created, eg. on a read only file system, only the fallback is used.
+    A statement that fails, eg. while another process holds the database locked, falls back for that call only.'''
+
+    def __init__(self, path=CLIENT_CACHE, fallback=None):
+        '''sets the location of the database
+        Keyword arguments:
+        path -- file of the sqlite database. Its folder is created if needed.
+        fallback -- ClientStore read when a client is missing from the database, eg. the json files shipped with this library
+        '''
+        self.path = path
+        self.fallback = fallback
+        self.__local = threading.local()  # sqlite connections cannot be shared between threads
+        self.__disabled = False  # set once the database could not be opened so the error is only reported once
+
+    def get(self, endpoint, signature=None):
+        row = self.__execute('SELECT signature, page_objects FROM clients WHERE endpoint = ?', (endpoint,))
+        # missing from the database or the database cannot be used
+        if not row:
+            if self.fallback is not None:
+                return self.fallback.get(endpoint, signature)
+            return None
+        # the objects or instances of the client changed since it was cached
+        if signature is not None and row[0] is not None and row[0] != signature:
+            return None
+        return json.loads(row[1])
+
+    def put(self, endpoint, page_objects, signature=None):
+        if self.__execute('INSERT OR REPLACE INTO clients (endpoint, signature, page_objects) VALUES (?, ?, ?)',
+                          (endpoint, signature, json.dumps(page_objects))) is False and self.fallback is not None:
+            self.fallback.put(endpoint, page_objects, signature)
+
+    def delete(self, endpoint):
+        if self.__execute('DELETE FROM clients WHERE endpoint = ?', (endpoint,)) is False and self.fallback is not None:
+            self.fallback.delete(endpoint)
+
+    def __execute(self, statement, parameters):
+        '''helper method that runs statement in a transaction and returns its first row.
+        Returns False if the database cannot be used or the statement failed.'''
+        import sqlite3
+        if self.__disabled:
+            return False
+        try:
+            connection = self.__connect()
+        except (OSError, sqlite3.Error) as e:
+            self.__disabled = True
+            log.warning("client cache %s cannot be used, clients are not cached there: %s", self.path, e)
+            return False
+        try:
+            with connection:
+                return connection.execute(statement, parameters).fetchone()
+        except sqlite3.Error as e:
+            # eg. the database is locked by another process for longer than the timeout, the next call tries again
+            log.warning("client cache %s failed, the fallback is used instead: %s", self.path, e)
+            return False
+
+    def __connect(self):
+        '''helper method that returns the connection of this thread, opening the database the first time'''
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            import sqlite3
+            connection = sqlite3.connect(self.path, timeout=30)
+            # readers are not blocked while another process writes
+            connection.execute('PRAGMA journal_mode=WAL')
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS clients '
+                                   '(endpoint TEXT PRIMARY KEY, signature TEXT, page_objects TEXT NOT NULL)')
+            self.__local.connection = connection
+        return connection
+
+
+DEFAULT_STORE = None
+
+def defaultStore():
+    '''returns the store used by clients that do not bring their own. It is a sqlite database at CLIENT_CACHE
+    that falls back on the clients shipped in the cached_clients folder of this library.'''
+    global DEFAULT_STORE
+    if DEFAULT_STORE is None:
+        DEFAULT_STORE = SqliteClientStore(CLIENT_CACHE, fallback=JsonClientStore(readonly=True))
+    return DEFAULT_STORE
+
+
+class FrozenDict(dict):
+    '''dictionary that cannot be changed once built so it can be shared by many clients'''
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("resource map is shared between clients and cannot be changed")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = __readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+class ResourceModel():
+    '''Read only resources of a client with the index used to resolve them. Clients with the same resources share
+    one model through intern(), so a fleet of devices of the same type holds a single copy.'''
+    __slots__ = ('page_objects', 'index', 'unique', 'names', 'instancePaths', 'resolved', '__weakref__')
+
+    __models = weakref.WeakValueDictionary()  # signature of the resources to the model shared by clients
+    __lock = threading.Lock()
+
+    @classmethod
+    def intern(cls, object_dict):
+        '''returns the model of object_dict, shared with every client that has the same resources
+        Keyword arguments:
+        object_dict -- nested dictionary of object>instance>resource giving the path of each resource
+        '''
+        # the signature keeps the order of the resources as it decides which match is found first
+        signature = json.dumps(object_dict)
+        with cls.__lock:
+            model = cls.__models.get(signature)
+            if model is None:
+                model = cls(object_dict)
+                cls.__models[signature] = model
+            return model
+
+    def __init__(self, object_dict):
+        '''builds the read only resources and the inverted index of lower case resource name to the
+        (object, instance, path) of each resource with that name
+        Keyword arguments:
+        object_dict -- nested dictionary of object>instance>resource giving the path of each resource
+        '''
+        intern = sys.intern
+        index = {}
+        names = {}
+        instance_paths = {}
+        objects = []
+        for obj_key, instances in object_dict.items():
+            obj_key = intern(obj_key)
+            frozen_instances = []
+            for inst_key, resources in instances.items():
+                # instance keys are strings however the resources were discovered
+                inst_key = intern(str(inst_key))
+                frozen_resources = []
+                for res_key, res_val in resources.items():
+                    res_key, res_val = intern(res_key), intern(res_val)
+                    frozen_resources.append((res_key, res_val))
+                    index.setdefault(intern(res_key.lower()), []).append((obj_key, inst_key, res_val))
+                    names[res_val] = res_key
+                    # the instance path is the resource path without the resource id eg. /3/0/1 -> /3/0
+                    instance_paths[(obj_key, inst_key)] = intern(res_val.rsplit('/', 1)[0])
+                frozen_instances.append((inst_key, FrozenDict(frozen_resources)))
+            objects.append((obj_key, FrozenDict(frozen_instances)))
+        self.page_objects = FrozenDict(objects)
+        self.index = {name: tuple(candidates) for name, candidates in index.items()}
+        self.names = names  # resource path to resource name for decoding instance and object reads
+        self.instancePaths = instance_paths
+        # names with a single candidate resolve without checking the object or instance given by the user
+        self.unique = {name: candidates[0][2] for name, candidates in index.items() if len(candidates) == 1}
+        self.resolved = {}  # (resource, object, instance) the user asked for to the path it resolved to
+
+
+class ModelRegistry():
+    '''Parses each xml object model once for the whole process. Parsed models are kept until their file changes
+    and can be persisted to a json file so later runs do not parse them again.'''
+
+    def __init__(self, cache_path=None):
+        '''sets the location of the persisted models
+        Keyword arguments:
+        cache_path -- json file the parsed models are persisted to. If None the models are only kept in memory.
+        '''
+        self.cache_path = cache_path
+        self.__models = {}  # xml file path to (mtime, object model)
+        self.__folders = {}  # models folder to (mtime, list of xml file paths)
+        self.__maps = {}  # (models folder, object links) to the resource map shared by clients
+        self.__lock = threading.RLock()
+        if cache_path is not None and os.path.isfile(cache_path):
+            with open(cache_path) as f:
+                self.__models = {path: (entry['mtime'], entry['spec']) for path, entry in json.load(f).items()}
+
+    def getSpecs(self, models):
+        '''returns the object models of the xml files in the models folder keyed on object id,
+        in the format of the leshan objectspecs api
+        Keyword arguments:
+        models -- folder of xml object models
+        '''
+        return self.__loadFolder(models)[0]
+
+    def resourceMap(self, models, links=None):
+        '''returns the page_objects of a client with the given models. Clients with the same models and
+        object links share one read only dictionary.
+        Keyword arguments:
+        models -- folder of xml object models
+        links -- objectLinks of the client registration. If None instance 0 of every model is used.
+        '''
+        with self.__lock:
+            specs, signature = self.__loadFolder(models)
+            if links is None:
+                links = [{'url': '/' + object_id + '/0'} for object_id in specs]
+            key = (os.path.abspath(models), tuple(sorted(link['url'] for link in links)))
+            resource_map = self.__maps.get(key)
+            # rebuild if any model file changed since the map was built
+            if resource_map is None or resource_map[0] != signature:
+                object_dict = buildPageObjects(links, specs)
+                frozen = FrozenDict((obj, FrozenDict((inst, FrozenDict(resources)) for inst, resources in instances.items()))
+                                    for obj, instances in object_dict.items())
+                resource_map = (signature, frozen)
+                self.__maps[key] = resource_map
+            return resource_map[1]
+
+    def save(self):
+        '''persist the parsed models to cache_path'''
+        if self.cache_path is None:
+            return
+        with self.__lock:
+            compiled = {path: {'mtime': mtime, 'spec': spec} for path, (mtime, spec) in self.__models.items()}
+        # write to a temporary file and swap it in so a reader never sees a partial file
+        temp_path = self.cache_path + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(compiled, f)
+        os.replace(temp_path, self.cache_path)
+
+    def clear(self):
+        '''forget every parsed model'''
+        with self.__lock:
+            self.__models.clear()
+            self.__folders.clear()
+            self.__maps.clear()
+
+    def __loadFolder(self, models):
+        '''helper method that returns the object models of the models folder keyed on object id and
+        the (file, mtime) signature of the models they were parsed from'''
+        with self.__lock:
+            specs = {}
+            signature = []
+            for file_path in self.__listFolder(models):
+                mtime, spec = self.__parseFile(file_path)
+                specs[spec['id']] = spec
+                signature.append((file_path, mtime))
+            return specs, tuple(signature)
+
+    def __listFolder(self, models):
+        '''helper method of loadFolder() that returns the xml files of the models folder, listing it again only when it changes'''
+        folder = os.path.abspath(models)
+        mtime = os.stat(folder).st_mtime
+        listing = self.__folders.get(folder)
+        if listing is None or listing[0] != mtime:
+            #ignore all files in models folder that are not xmls
+            files = [os.path.join(folder, filename) for filename in sorted(os.listdir(folder)) if filename.endswith(".xml")]
+            listing = (mtime, files)
+            self.__folders[folder] = listing
+        return listing[1]
+
+    def __parseFile(self, file_path):
+        '''helper method of loadFolder() that returns the (mtime, object model) of an xml file, parsing it only when it changes'''
+        mtime = os.stat(file_path).st_mtime
+        parsed = self.__models.get(file_path)
+        if parsed is not None and parsed[0] == mtime:
+            return parsed
+        import xml.etree.ElementTree as ET
+        # get the root of the xml document
+        root = ET.parse(file_path).getroot()
+        object_ = root.find('Object')
+        spec = {'id': object_.findtext('ObjectID').strip(), 'name': object_.findtext('Name').strip(), 'resourcedefs': []}
+        for resource in object_.findall('Resources/Item'):
+            spec['resourcedefs'].append({'id': resource.attrib['ID'], 'name': resource.findtext('Name').strip()})
+        self.__models[file_path] = (mtime, spec)
+        return mtime, spec
+
+
+MODEL_REGISTRY = ModelRegistry()  # registry shared by every client that does not bring its own
+
+
+class Metrics():
+    '''Records the time spent in each phase of the operations of servers and clients.
+    Keeps counters and latency histograms per operation and phase and per endpoint, and passes every span to the hooks.
+    Phases are resolve, request, decode and total. Loading the resources of a client is the operation load.'''
+
+    def __init__(self, hooks=None, buckets=LATENCY_BUCKETS, per_endpoint=True):
+        '''sets how the spans are recorded
+        Keyword arguments:
+        hooks -- list of functions called with every Span
+        buckets -- upper bounds in seconds of the latency histograms
+        per_endpoint -- also keep a histogram of the total time of each operation for each endpoint
+        '''
+        self.hooks = list(hooks or [])
+        self.buckets = tuple(buckets)
+        self.per_endpoint = per_endpoint
+        self.__histograms = {}  # (operation, phase) to histogram
+        self.__endpoints = {}  # (endpoint, operation) to histogram of the total time
+        self.__counters = {}  # (name, endpoint) to count
+        self.__lock = threading.Lock()
+
+    def addHook(self, hook):
+        '''call hook with every Span recorded from now on'''
+        self.hooks.append(hook)
+
+    def span(self, operation, phase, endpoint=None):
+        '''returns a context manager that records the time spent inside it as phase of operation
+        Keyword arguments:
+        operation -- name of the operation eg. read
+        phase -- name of the phase eg. request
+        endpoint -- endpoint name of the client the operation is on
+        '''
+        return _Timer(self, operation, phase, endpoint)
+
+    def record(self, operation, phase, endpoint, seconds):
+        '''record that phase of operation on endpoint took seconds
+        Keyword arguments:
+        operation -- name of the operation eg. read
+        phase -- name of the phase eg. request
+        endpoint -- endpoint name of the client the operation is on, or None
+        seconds -- time the phase took
+        '''
+        with self.__lock:
+            self.__observe(self.__histograms, (operation, phase), seconds)
+            if self.per_endpoint and endpoint is not None and phase == 'total':
+                self.__observe(self.__endpoints, (endpoint, operation), seconds)
+        if self.hooks:
+            span = Span(operation, phase, endpoint, seconds)
+            for hook in self.hooks:
+                hook(span)
+
+    def count(self, name, endpoint=None, n=1):
+        '''add n to the counter name of endpoint
+        Keyword arguments:
+        name -- name of the counter eg. client_cache_hit
+        endpoint -- endpoint name of the client counted, or None
+        n -- amount to add
+        '''
+        with self.__lock:
+            key = (name, endpoint)
+            self.__counters[key] = self.__counters.get(key, 0) + n
+
+    def counter(self, name, endpoint=None):
+        '''returns the counter name summed over all endpoints, or of a single endpoint if given'''
+        with self.__lock:
+            if endpoint is not None:
+                return self.__counters.get((name, endpoint), 0)
+            return sum(n for (counter, _), n in self.__counters.items() if counter == name)
+
+    def snapshot(self):
+        '''returns a json serializable dictionary of the counters and histograms recorded so far'''
+        with self.__lock:
+            operations = {}
+            for (operation, phase), histogram in self.__histograms.items():
+                operations.setdefault(operation, {})[phase] = self.__export(histogram)
+            endpoints = {}
+            for (endpoint, operation), histogram in self.__endpoints.items():
+                endpoints.setdefault(endpoint, {})[operation] = self.__export(histogram)
+            counters = {}
+            for (name, endpoint), n in self.__counters.items():
+                counters.setdefault(name, {})[endpoint if endpoint is not None else ''] = n
+            return {'buckets': list(self.buckets), 'operations': operations, 'endpoints': endpoints, 'counters': counters}
+
+    def prometheus(self, prefix='leshan'):
+        '''returns the counters and histograms in the prometheus text exposition format
+        Keyword arguments:
+        prefix -- prefix of the metric names
+        '''
+        snapshot = self.snapshot()
+        lines = ['# TYPE ' + prefix + '_operation_seconds histogram']
+        for operation, phases in sorted(snapshot['operations'].items()):
+            for phase, histogram in sorted(phases.items()):
+                labels = 'operation="' + operation + '",phase="' + phase + '"'
+                lines += self.__promHistogram(prefix + '_operation_seconds', labels, histogram)
+        lines.append('# TYPE ' + prefix + '_endpoint_seconds histogram')
+        for endpoint, operations in sorted(snapshot['endpoints'].items()):
+            for operation, histogram in sorted(operations.items()):
+                labels = 'endpoint="' + endpoint + '",operation="' + operation + '"'
+                lines += self.__promHistogram(prefix + '_endpoint_seconds', labels, histogram)
+        for name, endpoints in sorted(snapshot['counters'].items()):
+            lines.append('# TYPE ' + prefix + '_' + name + ' counter')
+            for endpoint, n in sorted(endpoints.items()):
+                labels = '{endpoint="' + endpoint + '"}' if endpoint else ''
+                lines.append(prefix + '_' + name + labels + ' ' + str(n))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        '''forget everything recorded so far'''
+        with self.__lock:
+            self.__histograms.clear()
+            self.__endpoints.clear()
+            self.__counters.clear()
+
+    def __observe(self, histograms, key, seconds):
+        '''helper method of record() that adds seconds to the histogram of key. The lock must be held.'''
+        histogram = histograms.get(key)
+        if histogram is None:
+            # one count per bucket and one for the times above the last bucket, then the sum of the times
+            histogram = [0] * (len(self.buckets) + 1) + [0.0]
+            histograms[key] = histogram
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        histogram[i] += 1
+        histogram[-1] += seconds
+
+    def __export(self, histogram):
+        '''helper method of snapshot() that returns a histogram as a dictionary'''
+        counts = histogram[:-1]
+        return {'count': sum(counts), 'sum': histogram[-1], 'counts': counts}
+
+    def __promHistogram(self, name, labels, histogram):
+        '''helper method of prometheus() that returns the lines of a cumulative histogram'''
+        lines = []
+        cumulative = 0
+        for bound, n in zip(list(self.buckets) + ['+Inf'], histogram['counts']):
+            cumulative += n
+            lines.append(name + '_bucket{' + labels + ',le="' + str(bound) + '"} ' + str(cumulative))
+        lines.append(name + '_sum{' + labels + '} ' + repr(histogram['sum']))
+        lines.append(name + '_count{' + labels + '} ' + str(histogram['count']))
+        return lines
+
+
+class _Timer():
+    '''context manager returned by Metrics.span()'''
+    __slots__ = ('metrics', 'operation', 'phase', 'endpoint', 'start')
+
+    def __init__(self, metrics, operation, phase, endpoint):
+        self.metrics = metrics
+        self.operation = operation
+        self.phase = phase
+        self.endpoint = endpoint
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.operation, self.phase, self.endpoint, time.perf_counter() - self.start)
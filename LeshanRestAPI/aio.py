@@ -0,0 +1,324 @@
+'''
+asyncio counterparts of Server and Client for keeping many device operations in flight on one event loop.
+Requires aiohttp: pip install LeshanRestAPI[async]
+
+Resources are resolved by the sync Client so the model cache, client store and value cache are shared with the sync classes.
+'''
+import asyncio
+import json
+import aiohttp
+from LeshanRestAPI import Server, TIMEOUT
+
+MAX_CONCURRENCY = 100  # operations in flight on one server
+MAX_PER_ENDPOINT = 1  # operations in flight on one device. Constrained devices handle one request at a time best.
+
+
+class AsyncServer():
+    '''returns information on the clients attached to the server without blocking the event loop'''
+
+    def __init__(self, url, server=None, max_concurrency=MAX_CONCURRENCY, max_per_endpoint=MAX_PER_ENDPOINT, **kwargs):
+        '''sets the server url and the limits of the operations in flight
+        Keyword arguments:
+        url -- url of the leshan server
+        server -- sync Server the clients and their resources are shared with. If None one is created with kwargs.
+        max_concurrency -- maximum number of operations in flight on the server
+        max_per_endpoint -- maximum number of operations in flight on a single client
+        '''
+        self.url = url
+        self.server = server if server is not None else Server(url, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.max_per_endpoint = max_per_endpoint
+        self.clients = {}  # AsyncClient objects already built for this server keyed on endpoint
+        self.session = None
+        self.__semaphore = None
+        self.__endpointSemaphores = {}
+
+    async def getClients(self, timeout=TIMEOUT):
+        '''return the client endpoints attached to this server'''
+        #sometimes the user may enter the url of the server with or without the #/clients appended to it.
+        if "clients" in self.url:
+            url = self.url.replace('#', 'api')
+        else:
+            url = self.url + "/api/clients"
+        async with self.__limit(None):
+            async with self.__getSession().get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                # raise error if http request fails
+                r.raise_for_status()
+                rDict = json.loads(await r.text())
+        clientList = []
+        for client in rDict:
+            clientList.append(client['endpoint'])
+            # share the object links with the sync server so clients check their cache without another request
+            self.server.setLinks(client['endpoint'], client.get('objectLinks'))
+        return clientList
+
+    async def getClient(self, endpoint, refresh=False):
+        '''return the async client of the given endpoint, creating it the first time it is requested
+        Keyword arguments:
+        endpoint -- endpoint name of the client
+        refresh -- get the elements by scraping the html even if we have the client cached.
+        '''
+        client = self.clients.get(endpoint)
+        if client is None or refresh:
+            # loading the resources may scrape or read the client store so it is kept off the event loop
+            sync_client = self.server.getClient(endpoint, refresh)
+            await asyncio.get_running_loop().run_in_executor(None, sync_client.load)
+            client = AsyncClient(sync_client, self)
+            self.clients[endpoint] = client
+        return client
+
+    async def readAll(self, resource, object_=None, instance=None, endpoints=None, timeout=TIMEOUT):
+        '''read a resource from many clients concurrently. Returns a tuple of dictionaries (results, errors)
+        keyed on endpoint, holding the value read or the exception raised for that endpoint.
+        Keyword arguments:
+        resource -- the resource to read on each client
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        endpoints -- list of endpoints to read from. If None every client attached to the server is read.
+        timeout -- time to do rest command before timing out
+        '''
+        return await self.__fanOut('read', (resource, object_, instance, timeout), endpoints)
+
+    async def writeAll(self, text, resource, object_=None, instance=None, endpoints=None, timeout=TIMEOUT):
+        '''write text to a resource on many clients concurrently. Returns a tuple of dictionaries (results, errors)
+        keyed on endpoint. results holds None for every successful write.
+        Keyword arguments:
+        text -- text to write to resource
+        resource -- the resource to write on each client
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        endpoints -- list of endpoints to write to. If None every client attached to the server is written.
+        timeout -- time to do rest command before timing out
+        '''
+        return await self.__fanOut('write', (text, resource, object_, instance, timeout), endpoints)
+
+    async def close(self):
+        '''close the connections of this server and its clients'''
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.server.close()
+
+    async def __fanOut(self, operation, args, endpoints):
+        '''helper method of the fleet wide operations that calls operation on each client concurrently.
+        The number of operations in flight is bounded by the server and endpoint limits.'''
+        if endpoints is None:
+            endpoints = await self.getClients()
+
+        async def call(endpoint):
+            client = await self.getClient(endpoint)
+            return await getattr(client, operation)(*args)
+
+        outcomes = await asyncio.gather(*[call(endpoint) for endpoint in endpoints], return_exceptions=True)
+        results = {}
+        errors = {}
+        for endpoint, outcome in zip(endpoints, outcomes):
+            if isinstance(outcome, Exception):
+                errors[endpoint] = outcome
+            else:
+                results[endpoint] = outcome
+        return results, errors
+
+    def __getSession(self):
+        '''helper method that returns the aiohttp session, creating it on the running event loop the first time'''
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    def __limit(self, endpoint):
+        '''helper method that returns the semaphore bounding the operations in flight on endpoint and the server'''
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+        if endpoint is None:
+            return self.__semaphore
+        semaphore = self.__endpointSemaphores.get(endpoint)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_endpoint)
+            self.__endpointSemaphores[endpoint] = semaphore
+        return _Limits(semaphore, self.__semaphore)
+
+    def request(self, endpoint, method, url, timeout, **kwargs):
+        '''returns an async context manager of the http request within the limits of endpoint
+        Keyword arguments:
+        endpoint -- endpoint name of the client the request is for
+        method -- http method
+        url -- url to request
+        timeout -- time to do rest command before timing out
+        '''
+        return _Request(self.__limit(endpoint), self.__getSession(), method, url,
+                        aiohttp.ClientTimeout(total=timeout), kwargs)
+
+    def __str__(self):
+        return self.url
+
+
+class AsyncClient():
+    '''asyncio counterpart of Client. Resources are resolved by the wrapped sync Client.'''
+
+    def __init__(self, client, server):
+        '''sets the information required for REST commands
+        Keyword arguments:
+        client -- sync Client of the endpoint
+        server -- AsyncServer the requests are made through
+        '''
+        self.client = client
+        self.server = server
+        self.requestUrl = client.requestUrl
+
+    async def read(self, resource, object_=None, instance=None, timeout=TIMEOUT):
+        '''reads the value of the specified instance and resource on the leshan server
+        Keyword arguments:
+        resource -- the resource to read
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        timeout -- time to do rest command before timing out
+        '''
+        res_id = self.client.resolve(resource, object_, instance)
+        cache = self.client.cache
+        # serve the value from the cache if it was read recently
+        if cache is not None:
+            hit, value = cache.get(self.client.client, res_id)
+            if hit:
+                return value
+        async with self.__request('GET', res_id, timeout) as r:
+            r.raise_for_status()
+            rDict = json.loads(await r.text())
+        try:
+            value = rDict['content']['value']
+        except KeyError:
+            raise KeyError("resource " + resource +
+                           " is not available for reading")
+        if cache is not None:
+            cache.put(self.client.client, res_id, value)
+        return value
+
+    async def write(self, text, resource, object_=None, instance=None, timeout=TIMEOUT):
+        '''writes text to selected resource on the leshan server
+        Keyword arguments:
+        text -- text to write to resource
+        resource -- resource you want to write to
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        timeout -- time to do rest command before timing out
+        '''
+        res_id = self.client.resolve(resource, object_, instance)
+        self.__invalidate(res_id)
+        async with self.__request('PUT', res_id, timeout, json={'id': res_id.split("/")[-1], 'value': text}) as r:
+            r.raise_for_status()
+
+    async def observe(self, resource, object_=None, instance=None, timeout=TIMEOUT, stream=None, callback=None):
+        '''Observe the selected resource on the leshan server
+        Keyword arguments:
+        resource -- resource you want to observe
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        timeout -- time to do rest command before timing out
+        stream -- EventStream to deliver the notifications of this resource on, usually Server.events()
+        callback -- function called with each Notification of this resource received on stream
+        '''
+        res_id = self.client.resolve(resource, object_, instance)
+        if stream is not None:
+            stream.subscribe(self.client.client, res_id, callback)
+        async with self.__request('POST', res_id + '/observe', timeout) as r:
+            r.raise_for_status()
+
+    async def discover(self, resource, object_=None, instance=None, timeout=TIMEOUT):
+        '''discover the selected resource on the leshan server
+        Keyword arguments:
+        resource -- resource you want to discover
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        timeout -- time to do rest command before timing out
+        '''
+        res_id = self.client.resolve(resource, object_, instance)
+        async with self.__request('GET', res_id + '/discover', timeout) as r:
+            r.raise_for_status()
+
+    async def execute(self, resource, object_=None, instance=None, timeout=TIMEOUT):
+        '''Execute the selected resource on the leshan server
+        Keyword arguments:
+        resource -- resource you want to execute
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        timeout -- time to do rest command before timing out
+        '''
+        res_id = self.client.resolve(resource, object_, instance)
+        # executing a resource may change any resource of its instance
+        self.__invalidate(res_id.rsplit('/', 1)[0])
+        async with self.__request('POST', res_id, timeout) as r:
+            r.raise_for_status()
+
+    async def delete(self, resource, object_=None, instance=None, timeout=TIMEOUT):
+        '''delete the given resource on the leshan server.
+        Keyword arguments:
+        resource -- the resource to delete
+        object_ -- the highest level object containing the instance and resource
+        instance -- the instance of this resource under the object
+        timeout -- time to do rest command before timing out
+        '''
+        res_id = self.client.resolve(resource, object_, instance)
+        self.__invalidate(res_id)
+        async with self.__request('DELETE', res_id, timeout) as r:
+            r.raise_for_status()
+
+    def __request(self, method, res_id, timeout, **kwargs):
+        '''helper method that returns the request of res_id on this client'''
+        return self.server.request(self.client.client, method, self.requestUrl + res_id, timeout, **kwargs)
+
+    def __invalidate(self, path):
+        '''helper method that forgets the cached values under path'''
+        if self.client.cache is not None:
+            self.client.cache.invalidate(self.client.client, path)
+
+    def __str__(self):
+        return str(self.client)
+
+
+class _Limits():
+    '''async context manager acquiring the endpoint semaphore and then the server semaphore'''
+
+    def __init__(self, endpoint, server):
+        self.endpoint = endpoint
+        self.server = server
+
+    async def __aenter__(self):
+        # the endpoint is acquired first so requests queued on a busy device do not hold a server slot
+        await self.endpoint.acquire()
+        try:
+            await self.server.acquire()
+        except BaseException:
+            self.endpoint.release()
+            raise
+
+    async def __aexit__(self, *exc):
+        self.server.release()
+        self.endpoint.release()
+
+
+class _Request():
+    '''async context manager of an http request made within limits'''
+
+    def __init__(self, limits, session, method, url, timeout, kwargs):
+        self.limits = limits
+        self.session = session
+        self.method = method
+        self.url = url
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.response = None
+
+    async def __aenter__(self):
+        await self.limits.__aenter__()
+        try:
+            self.response = await self.session.request(self.method, self.url, timeout=self.timeout, **self.kwargs)
+            # read the body while the slot is held so the connection is released with it
+            await self.response.read()
+        except BaseException:
+            await self.limits.__aexit__(None, None, None)
+            raise
+        return self.response
+
+    async def __aexit__(self, *exc):
+        self.response.release()
+        await self.limits.__aexit__(*exc)
@@ -0,0 +1,277 @@
+'''
+Rate limited campaigns that run a write, execute or any other Client operation across a fleet.
+
+A campaign is throttled by a global rate, a per endpoint rate and a concurrency cap. Transient failures are
+retried with exponential backoff, only when the request could not be sent for operations such as execute, and progress can be saved to a file so an interrupted campaign resumes
+where it stopped.
+'''
+import heapq
+import json
+import os
+import threading
+import time
+import requests
+import urllib3
+from LeshanRestAPI import MAX_WORKERS
+
+RETRIES = 3  # attempts after the first for a transient failure
+BACKOFF = 1  # seconds before the first retry. Doubled for each further retry.
+REPORT_INTERVAL = 1  # seconds between progress reports and saves of the campaign state
+# Client operations that leave the device in the same state when repeated, so they can be retried after a read timeout
+IDEMPOTENT = frozenset(['read', 'readInstance', 'readObject', 'readMany', 'write', 'observe', 'discover', 'delete'])
+
+
+def isTransient(error, idempotent=True):
+    '''returns True if the operation failed in a way that may succeed when tried again
+    Keyword arguments:
+    error -- exception raised by the operation
+    idempotent -- the operation can be repeated safely. If False only failures to connect are transient, as once
+                  the request was sent the device may already have run it.
+    '''
+    if not idempotent:
+        return isNotSent(error)
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        # server errors, device timeouts reported by leshan and throttling
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return False
+
+
+def isNotSent(error):
+    '''returns True if error was raised before the request was sent: a connect timeout, a refused connection or a
+    failed name lookup. A connection dropped after the request was sent, eg. Connection aborted, returns False.'''
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    reason = error.args[0]
+    # requests wraps the urllib3 error in the MaxRetryError of the pool
+    if isinstance(reason, urllib3.exceptions.MaxRetryError):
+        reason = reason.reason
+    # name lookup failures are NewConnectionErrors too
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def printProgress(report):
+    '''progress callback that prints a line for each report'''
+    print('{done}/{total} done, {failed} failed, {retrying} retrying, {rate:.1f} ops/s, {elapsed:.0f}s elapsed'.format(**report))
+
+
+class RateLimiter():
+    '''token bucket allowing rate operations per second with bursts of up to burst operations'''
+
+    def __init__(self, rate, burst=1):
+        '''sets the rate of the limiter
+        Keyword arguments:
+        rate -- operations allowed per second
+        burst -- operations allowed at once after a quiet period
+        '''
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        '''wait until an operation is allowed'''
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+                self.__last = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+
+class Campaign():
+    '''Runs one Client operation on many endpoints of a Server as fast as the limits allow'''
+
+    def __init__(self, server, operation, args=(), kwargs=None, endpoints=None, rate=None, endpoint_rate=None,
+                 max_workers=MAX_WORKERS, retries=RETRIES, backoff=BACKOFF, state_path=None, progress=None,
+                 report_interval=REPORT_INTERVAL, idempotent=None):
+        '''sets the operation and limits of the campaign
+        Keyword arguments:
+        server -- Server the clients are attached to
+        operation -- name of the Client method to call eg. write, or a function called with the Client
+        args -- positional arguments of the operation eg. ('300', 'Lifetime')
+        kwargs -- keyword arguments of the operation
+        endpoints -- list of endpoints to run on. If None every client attached to the server is used.
+        rate -- maximum operations per second over the whole campaign. If None it is not limited.
+        endpoint_rate -- maximum operations per second on a single endpoint, retries included. If None it is not limited.
+        max_workers -- maximum number of operations in flight at once. Capped at the pool_maxsize of the server.
+        retries -- attempts after the first for a transient failure
+        backoff -- seconds before the first retry. Doubled for each further retry.
+        state_path -- json file the progress is saved to. An existing file is resumed from.
+        progress -- function called with a progress report every report_interval seconds and at the end
+        report_interval -- seconds between progress reports and saves of the state
+        idempotent -- the operation can be retried after a timeout or server error. If None it is True for the Client
+                      operations in IDEMPOTENT and False otherwise, eg. for execute or a function, which are only
+                      retried when the connection could not be made.
+        '''
+        self.server = server
+        self.operation = operation
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.endpoints = endpoints
+        self.limiter = RateLimiter(rate) if rate else None
+        self.endpoint_interval = 1.0 / endpoint_rate if endpoint_rate else 0
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.state_path = state_path
+        self.progress = progress
+        self.report_interval = report_interval
+        if idempotent is None:
+            idempotent = operation in IDEMPOTENT
+        self.idempotent = idempotent
+        self.state = {}  # endpoint to {'status': pending/retrying/done/failed, 'attempts': n, 'error': str}
+        self.__queue = []  # heap of (time the endpoint may run, sequence, endpoint)
+        self.__sequence = 0
+        self.__nextAllowed = {}  # endpoint to the time its next operation is allowed
+        self.__running = 0
+        self.__condition = threading.Condition()
+        self.__stopped = False
+        self.__finished = threading.Event()
+        self.__start = None
+
+    def run(self):
+        '''run the campaign until every endpoint is done or has failed and return the summary report'''
+        self.__load()
+        endpoints = self.endpoints if self.endpoints is not None else self.server.getClients()
+        now = time.monotonic()
+        for endpoint in endpoints:
+            entry = self.state.setdefault(endpoint, {'status': 'pending', 'attempts': 0, 'error': None})
+            # endpoints finished by an earlier run are not repeated
+            if entry['status'] in ('done', 'failed'):
+                continue
+            entry['status'] = 'pending'
+            self.__push(now, endpoint)
+        self.__start = time.monotonic()
+        self.__stopped = False
+        self.__finished.clear()
+        workers = [threading.Thread(target=self.__work, daemon=True) for _ in range(self.server.maxWorkers(self.max_workers))]
+        for worker in workers:
+            worker.start()
+        try:
+            # report progress and save the state until the workers run out of endpoints
+            while not self.__finished.wait(self.report_interval):
+                self.__report()
+        finally:
+            self.stop()
+            for worker in workers:
+                worker.join()
+            self.save()
+        return self.__report()
+
+    def stop(self):
+        '''stop starting new operations. Operations in flight finish and the state can be resumed later.'''
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+        self.__finished.set()
+
+    def summary(self):
+        '''returns the progress report of the campaign'''
+        counts = {'pending': 0, 'retrying': 0, 'done': 0, 'failed': 0}
+        with self.__condition:
+            for entry in self.state.values():
+                counts[entry['status']] += 1
+        elapsed = time.monotonic() - self.__start if self.__start is not None else 0
+        finished = counts['done'] + counts['failed']
+        return dict(counts, total=len(self.state), elapsed=elapsed, rate=finished / elapsed if elapsed else 0,
+                    errors={endpoint: entry['error'] for endpoint, entry in self.state.items()
+                            if entry['status'] == 'failed'})
+
+    def save(self):
+        '''save the progress to state_path so the campaign can be resumed'''
+        if self.state_path is None:
+            return
+        with self.__condition:
+            state = json.dumps(self.state)
+        # write to a temporary file and swap it in so an interrupted save does not lose the progress
+        temp_path = self.state_path + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(state)
+        os.replace(temp_path, self.state_path)
+
+    def __load(self):
+        '''helper method of run() that resumes the progress saved in state_path'''
+        if self.state_path is not None and os.path.isfile(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+
+    def __report(self):
+        '''helper method of run() that saves the state and passes the progress report to the progress callback'''
+        self.save()
+        report = self.summary()
+        if self.progress is not None:
+            self.progress(report)
+        return report
+
+    def __push(self, ready, endpoint):
+        '''helper method that queues endpoint to run at time ready. The condition must be held or the workers not started.'''
+        self.__sequence += 1
+        heapq.heappush(self.__queue, (ready, self.__sequence, endpoint))
+
+    def __next(self):
+        '''helper method of the workers that waits for the next endpoint allowed to run. Returns None when the campaign is over.'''
+        with self.__condition:
+            while True:
+                if self.__stopped:
+                    return None
+                if not self.__queue:
+                    # retries may still be queued by operations in flight
+                    if self.__running == 0:
+                        self.__finished.set()
+                        self.__condition.notify_all()
+                        return None
+                    self.__condition.wait()
+                    continue
+                ready, _, endpoint = self.__queue[0]
+                wait = ready - time.monotonic()
+                if wait > 0:
+                    self.__condition.wait(wait)
+                    continue
+                heapq.heappop(self.__queue)
+                # an endpoint still inside its per endpoint interval goes back in the queue until it is allowed
+                allowed = self.__nextAllowed.get(endpoint, 0)
+                if allowed > time.monotonic():
+                    self.__push(allowed, endpoint)
+                    continue
+                self.__running += 1
+                self.__nextAllowed[endpoint] = time.monotonic() + self.endpoint_interval
+                return endpoint
+
+    def __work(self):
+        '''worker thread that runs the operation on endpoints until the campaign is over'''
+        while True:
+            endpoint = self.__next()
+            if endpoint is None:
+                return
+            if self.limiter is not None:
+                self.limiter.acquire()
+            error = None
+            try:
+                client = self.server.getClient(endpoint)
+                if callable(self.operation):
+                    self.operation(client, *self.args, **self.kwargs)
+                else:
+                    getattr(client, self.operation)(*self.args, **self.kwargs)
+            except Exception as e:
+                error = e
+            with self.__condition:
+                entry = self.state[endpoint]
+                entry['attempts'] += 1
+                if error is None:
+                    entry['status'], entry['error'] = 'done', None
+                elif isTransient(error, self.idempotent) and entry['attempts'] <= self.retries:
+                    entry['status'], entry['error'] = 'retrying', repr(error)
+                    self.__push(time.monotonic() + self.backoff * 2 ** (entry['attempts'] - 1), endpoint)
+                else:
+                    entry['status'], entry['error'] = 'failed', repr(error)
+                self.__running -= 1
+                self.__condition.notify_all()
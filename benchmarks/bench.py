@@ -0,0 +1,243 @@
+'''
+Benchmarks of LeshanRestAPI against a local stub leshan server.
+
+usage: python benchmarks/bench.py [--latency SECONDS] [--iterations N] [--sizes 10 1000 10000] [--workers N]
+
+Reports throughput and p50/p99 latency of Client.read/write with and without hedging, the cost of resolving resource names,
+the memory of a fleet of loaded clients, html and xml model parsing time and Server fleet sweeps.
+'''
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from LeshanRestAPI import Client, Server, ClientStore, ModelRegistry, ResourceModel, LatencyTracker, parsePage, MAX_WORKERS, DIR_PATH  # noqa: E402
+from stub_leshan import StubLeshan  # noqa: E402
+
+MODEL = os.path.join(DIR_PATH, 'cached_clients', 'hexa_test.json')  # client model every stub device uses
+
+
+class MemoryStore(ClientStore):
+    '''client store that returns the same page_objects for every endpoint so clients are built without discovery'''
+
+    def __init__(self, page_objects):
+        self.page_objects = page_objects
+
+    def get(self, endpoint, signature=None):
+        return self.page_objects
+
+    def put(self, endpoint, page_objects, signature=None):
+        pass
+
+    def delete(self, endpoint):
+        pass
+
+
+def percentile(latencies, q):
+    '''returns the q percentile of the sorted latencies'''
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+def measure(operation, iterations):
+    '''returns the sorted latencies in seconds of calling operation iterations times'''
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def report(name, latencies, operations=None):
+    '''print the throughput and latency percentiles of a benchmark and return them as a dictionary
+    Keyword arguments:
+    name -- name of the benchmark
+    latencies -- sorted latencies in seconds
+    operations -- number of operations done in each measured call. Defaults to one.
+    '''
+    operations = operations or 1
+    total = sum(latencies)
+    result = {'name': name, 'ops_per_s': operations * len(latencies) / total if total else float('inf'),
+              'p50_ms': percentile(latencies, 0.50) * 1000, 'p99_ms': percentile(latencies, 0.99) * 1000}
+    print('{name:<40} {ops_per_s:>12.1f} ops/s   p50 {p50_ms:>10.3f} ms   p99 {p99_ms:>10.3f} ms'.format(**result))
+    return result
+
+
+def benchReadWrite(page_objects, latency, iterations):
+    '''Client.read and Client.write round trips against the stub'''
+    with StubLeshan(page_objects, ['device-0'], latency) as stub:
+        client = Client(stub.url + '/#/clients/device-0', store=MemoryStore(page_objects))
+        return [report('Client.read', measure(lambda: client.read('Lifetime', 'lwm2m server', 0), iterations)),
+                report('Client.write', measure(lambda: client.write('60', 'Lifetime', 'lwm2m server', 0), iterations)),
+                report('Client.readInstance (9 resources)',
+                       measure(lambda: client.readInstance('lwm2m server', 0), iterations), 9)]
+
+
+def benchHedge(page_objects, latency, iterations):
+    '''Client.read of a device where one in fifty operations is slow, with fixed timeouts and with hedged reads'''
+    results = []
+    for name, tracker in (('Client.read tail latency', None), ('Client.read hedged', LatencyTracker(hedge=0.9))):
+        # the same sequence of slow operations for both runs
+        rng = random.Random(0)
+        with StubLeshan(page_objects, ['device-0'], lambda endpoint: latency + (0.2 if rng.random() < 0.02 else 0)) as stub:
+            client = Client(stub.url + '/#/clients/device-0', store=MemoryStore(page_objects), latency=tracker)
+            # warm up so the tracker has the response times it needs to hedge
+            measure(lambda: client.read('Lifetime', 'lwm2m server', 0), LatencyTracker().min_samples)
+            results.append(report(name, measure(lambda: client.read('Lifetime', 'lwm2m server', 0), iterations)))
+        if tracker is not None:
+            tracker.close()
+    return results
+
+
+def benchResolve(page_objects, iterations):
+    '''resolving resource names to paths, on first use and memoized'''
+    client = object.__new__(Client)
+    client.page_objects = page_objects
+    names = [name for instances in page_objects.values() for resources in instances.values() for name in resources]
+    unique = [name for name in set(names) if names.count(name) == 1]
+    object_name, instances = next((o, i) for o, i in page_objects.items() if len(i) > 1)
+    instance, resources = next(iter(instances.items()))
+    shared = next(iter(resources))
+
+    return [report('resolve index build', measure(lambda: ResourceModel(page_objects), iterations)),
+            report('resolve shared index lookup', measure(lambda: ResourceModel.intern(page_objects), iterations)),
+            report('resolve unique name', measure(lambda: client.resolve(unique[0]), iterations)),
+            report('resolve name with object and instance',
+                   measure(lambda: client.resolve(shared, object_name, instance), iterations))]
+
+
+def benchMemory(page_objects, size):
+    '''memory held by a fleet of loaded clients of the same device type built by Server.getClient from their registrations'''
+    store = MemoryStore(page_objects)
+    # the registration of every device, decoded per device as Server.iterClients does
+    with StubLeshan(page_objects, 0) as stub:
+        registration = json.dumps({'objectLinks': stub.links})
+    server = Server('http://localhost', store=store)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(size):
+        endpoint = 'device-' + str(i)
+        server.getClient(endpoint, links=json.loads(registration)['objectLinks']).load()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    server.close()
+    result = {'name': 'memory of loaded clients', 'clients': size, 'bytes_per_client': used / size}
+    print('{name:<40} {clients:>12d} clients {bytes_per_client:>10.0f} bytes/client'.format(**result))
+    return [result]
+
+
+def buildHTML(page_objects):
+    '''returns html laid out like the leshan client page for page_objects'''
+    parts = ['<html><body>']
+    for object_name, instances in page_objects.items():
+        parts.append('<div ng-repeat="object in objects"><span class="object-name">' + object_name + '</span>')
+        for resources in instances.values():
+            parts.append('<div ng-repeat="instance in object.instances">')
+            for resource_name, path in resources.items():
+                parts.append('<div ng-repeat="resource in instance.resources" class="resource">'
+                             '<span class="resource-name">\n  ' + resource_name + ' <br></span>'
+                             '<button tooltip-html-unsafe="Path&gt;' + path + '">Read</button>'
+                             '<button tooltip-html-unsafe="Observe&gt;">Observe</button></div>')
+            parts.append('</div>')
+        parts.append('</div>')
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def benchParseHTML(page_objects, iterations):
+    '''parsing the scraped client page into page_objects, single pass and with the BeautifulSoup tree walk'''
+    html = buildHTML(page_objects)
+    size = len(html) // 1024
+    results = [report('parsePage ({} kB)'.format(size), measure(lambda: parsePage(html), iterations))]
+    try:
+        from parse_bs4 import parseHTML
+    except ImportError:
+        print('parseHTML skipped, bs4 is not installed')
+        return results
+    results.append(report('parseHTML bs4 ({} kB)'.format(size), measure(lambda: parseHTML(html), iterations)))
+    return results
+
+
+def writeModels(page_objects, folder):
+    '''write an lwm2m xml model of each object of page_objects to folder'''
+    for object_name, instances in page_objects.items():
+        resources = next(iter(instances.values()), {})
+        if not resources:
+            continue
+        object_id = next(iter(resources.values())).split('/')[1]
+        items = ''.join('<Item ID="{}"><Name>{}</Name><Operations>RW</Operations></Item>'.format(
+            path.split('/')[-1], name) for name, path in resources.items())
+        with open(os.path.join(folder, object_id + '.xml'), 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?><LWM2M><Object ObjectType="MODefinition">'
+                    '<Name>{}</Name><Description1></Description1><ObjectID>{}</ObjectID>'
+                    '<Resources>{}</Resources></Object></LWM2M>'.format(object_name, object_id, items))
+
+
+def benchParseXML(page_objects, iterations):
+    '''parsing the xml models folder, for a new process and once the registry holds the models'''
+    folder = tempfile.mkdtemp()
+    try:
+        writeModels(page_objects, folder)
+        registry = ModelRegistry()
+        return [report('xml models parse', measure(lambda: ModelRegistry().resourceMap(folder), iterations)),
+                report('xml models from registry', measure(lambda: registry.resourceMap(folder), iterations))]
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchFleet(page_objects, sizes, latency, workers):
+    '''Server.getClients and Server.readAll sweeps over fleets of each size.
+    A sweep is timed as a whole so its p50 and p99 are the time of the sweep.'''
+    results = []
+    for size in sizes:
+        with StubLeshan(page_objects, size, latency) as stub:
+            server = Server(stub.url, store=MemoryStore(page_objects), pool_maxsize=workers)
+            start = time.perf_counter()
+            endpoints = server.getClients()
+            results.append(report('Server.getClients ({})'.format(size), [time.perf_counter() - start], size))
+            # the first sweep builds the clients, the second only reads
+            for sweep in ('first', 'warm'):
+                start = time.perf_counter()
+                values, errors = server.readAll('Lifetime', 'lwm2m server', 0, endpoints, max_workers=workers)
+                results.append(report('Server.readAll {} sweep ({})'.format(sweep, size),
+                                      [time.perf_counter() - start], size))
+                if errors:
+                    print('  {} errors, eg. {!r}'.format(len(errors), next(iter(errors.values()))))
+            server.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0, help='seconds each device operation takes on the stub')
+    parser.add_argument('--iterations', type=int, default=200, help='calls measured by each benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000], help='fleet sizes to sweep')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='concurrent operations in a fleet sweep')
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args(argv)
+
+    with open(MODEL) as f:
+        page_objects = json.load(f)
+    results = []
+    results += benchReadWrite(page_objects, args.latency, args.iterations)
+    results += benchHedge(page_objects, args.latency, args.iterations)
+    results += benchResolve(page_objects, args.iterations)
+    results += benchMemory(page_objects, max(args.sizes))
+    results += benchParseHTML(page_objects, max(1, args.iterations // 10))
+    results += benchParseXML(page_objects, max(1, args.iterations // 10))
+    results += benchFleet(page_objects, args.sizes, args.latency, args.workers)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
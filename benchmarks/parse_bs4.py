@@ -0,0 +1,40 @@
+'''
+The BeautifulSoup walk of the leshan client page that parsePage() replaced. Kept as the reference the output of
+parsePage() is tested against and to compare their speed. Requires bs4: pip install beautifulsoup4
+'''
+from bs4 import BeautifulSoup
+
+
+def parseHTML(html):
+    '''parses the html of the leshan client webpage into a dictionary containing each object, instance and resource
+    Keyword arguments:
+    html -- text of the client page
+    '''
+    page_source = BeautifulSoup(html, 'html.parser')
+    object_dict = {}
+    # the Leshan html is a tree structure with elements given as objects>instances>resources
+    objects = page_source.find_all(
+        attrs={'ng-repeat': 'object in objects'})
+    # for each object we find all elements that contain the instances
+    for object_ in objects:
+        instances = object_.find_all(
+            attrs={'ng-repeat': 'instance in object.instances'})
+        instance_dict = {}
+        # for each instance element we find we find all resources attached to that resource
+        for i in range(len(instances)):
+            resources = instances[i].find_all(
+                attrs={'ng-repeat': 'resource in instance.resources'})
+            resource_dict = {}
+            # find the resource_name and id and put that into the dictionary
+            for resource in resources:
+                resource_name = resource.find(
+                    class_='resource-name').text.strip()
+                resource_id = resource.find(
+                    'button').attrs['tooltip-html-unsafe'].split('>')[1]
+                resource_dict[resource_name] = resource_id
+            instance_dict[i] = resource_dict
+        # we put all the resource objects into a nested dictionary of object>instance>resources
+        object_name = object_.find(class_='object-name').text.strip()
+        object_dict[object_name] = instance_dict
+
+    return object_dict
@@ -0,0 +1,156 @@
+'''
+In-process stand-in for a leshan server used by the benchmarks.
+
+Emulates /api/clients, the registration and objectspecs of each client and resource GET/PUT/POST/DELETE
+with a configurable latency per device. Every client has the same object model.
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+import json
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    '''threaded http server that accepts the bursts of connections of a fleet sweep'''
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class StubLeshan():
+    '''leshan server stand-in listening on localhost'''
+
+    def __init__(self, page_objects, endpoints=10, latency=0, port=0):
+        '''sets the clients served by the stub
+        Keyword arguments:
+        page_objects -- object>instance>resources dictionary every client is modeled on
+        endpoints -- number of clients registered, or a list of their endpoint names
+        latency -- seconds each device operation takes, or a function of the endpoint returning the seconds
+        port -- port to listen on. 0 picks a free port.
+        '''
+        if isinstance(endpoints, int):
+            endpoints = ['device-' + str(i) for i in range(endpoints)]
+        self.endpoints = endpoints
+        self.latency = latency if callable(latency) else (lambda endpoint: latency)
+        self.values = {}  # (endpoint, path) to the last value written
+        self.requests = 0
+        self.specs, self.links = self.__buildModel(page_objects)
+        # the bodies that do not change are encoded once so the stub is not the bottleneck
+        self.specsBody = json.dumps(list(self.specs.values())).encode()
+        self.clientsBody = json.dumps([{'endpoint': endpoint, 'registrationId': str(i), 'objectLinks': self.links}
+                                       for i, endpoint in enumerate(endpoints)]).encode()
+        self.__httpd = _HTTPServer(('127.0.0.1', port), self.__handler())
+        self.__thread = None
+
+    @property
+    def url(self):
+        '''url of the stub server'''
+        return 'http://127.0.0.1:' + str(self.__httpd.server_port)
+
+    def start(self):
+        '''serve requests from a background thread'''
+        self.__thread = threading.Thread(target=self.__httpd.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        '''stop serving requests'''
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __buildModel(self, page_objects):
+        '''returns the objectspecs keyed on object id and the object links that page_objects was built from'''
+        specs = {}
+        links = []
+        for object_name, instances in page_objects.items():
+            for resources in instances.values():
+                for resource_name, path in resources.items():
+                    object_id, instance_id, resource_id = path.strip('/').split('/')
+                    spec = specs.setdefault(object_id, {'id': int(object_id), 'name': object_name, 'resourcedefs': {}})
+                    spec['resourcedefs'][resource_id] = {'id': int(resource_id), 'name': resource_name}
+                    link = {'url': '/' + object_id + '/' + instance_id, 'attributes': {}}
+                    if link not in links:
+                        links.append(link)
+        specs = {object_id: dict(spec, resourcedefs=list(spec['resourcedefs'].values())) for object_id, spec in specs.items()}
+        return specs, links
+
+    def __handler(self):
+        '''returns the request handler class bound to this stub'''
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep connections alive like a real server
+            disable_nagle_algorithm = True  # headers and body are written separately, do not wait on delayed acks
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                if parts == ['api', 'clients']:
+                    return self.__send(stub.clientsBody)
+                if parts[1] == 'objectspecs':
+                    return self.__send(stub.specsBody)
+                endpoint, path = parts[2], parts[3:]
+                if len(path) == 0:
+                    return self.__sendJSON({'endpoint': endpoint, 'objectLinks': stub.links})
+                self.__delay(endpoint)
+                if path[-1] == 'discover':
+                    return self.__sendJSON({'status': 'CONTENT', 'objectLinks': []})
+                if len(path) == 3:
+                    return self.__sendJSON({'status': 'CONTENT', 'content': self.__resource(endpoint, path)})
+                if len(path) == 2:
+                    return self.__sendJSON({'status': 'CONTENT', 'content': self.__instance(endpoint, path)})
+                instances = [link['url'].split('/')[2] for link in stub.links if link['url'].split('/')[1] == path[0]]
+                return self.__sendJSON({'status': 'CONTENT', 'content': {
+                    'id': int(path[0]), 'instances': [self.__instance(endpoint, [path[0], i]) for i in instances]}})
+
+            def do_PUT(self):
+                parts = self.path.strip('/').split('/')
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                self.__delay(parts[2])
+                stub.values[(parts[2], '/' + '/'.join(parts[3:]))] = body.get('value')
+                self.__sendJSON({'status': 'CHANGED'})
+
+            def do_POST(self):
+                parts = self.path.strip('/').split('/')
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.__delay(parts[2])
+                self.__sendJSON({'status': 'CHANGED'})
+
+            def do_DELETE(self):
+                parts = self.path.strip('/').split('/')
+                self.__delay(parts[2])
+                self.__sendJSON({'status': 'DELETED'})
+
+            def __delay(self, endpoint):
+                stub.requests += 1
+                latency = stub.latency(endpoint)
+                if latency:
+                    time.sleep(latency)
+
+            def __resource(self, endpoint, path):
+                res_path = '/' + '/'.join(path)
+                return {'id': int(path[-1]), 'value': stub.values.get((endpoint, res_path), res_path)}
+
+            def __instance(self, endpoint, path):
+                resourcedefs = stub.specs[path[0]]['resourcedefs']
+                return {'id': int(path[-1]),
+                        'resources': [self.__resource(endpoint, path + [str(r['id'])]) for r in resourcedefs]}
+
+            def __sendJSON(self, obj):
+                self.__send(json.dumps(obj).encode())
+
+            def __send(self, body):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
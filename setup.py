@@ -19,6 +19,7 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ),
-    install_requires=['requests','selenium','bs4'],
+    install_requires=['requests','selenium'],
+    extras_require={'async': ['aiohttp']},
     license='MIT',
 )
\ No newline at end of file
@@ -0,0 +1,211 @@
+'''
+Tests of the retry rules of campaigns and of Campaign retry, resume and rate limiting, with a fake server.
+'''
+import json
+import socket
+import threading
+import time
+import pytest
+import requests
+import urllib3
+from LeshanRestAPI.campaign import Campaign, isTransient
+
+E = requests.exceptions
+
+
+def httpError(status):
+    response = requests.Response()
+    response.status_code = status
+    return E.HTTPError(response=response)
+
+
+def connectionError(reason):
+    '''returns the ConnectionError requests raises for reason, wrapped in the MaxRetryError of the pool'''
+    return E.ConnectionError(urllib3.exceptions.MaxRetryError(None, '/3/0/4', reason))
+
+
+def closingServer():
+    '''returns the port of a server that reads one request and closes the connection without answering'''
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def serve():
+        connection, _ = listener.accept()
+        connection.recv(65536)
+        connection.close()
+        listener.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def freePort():
+    '''returns a port nothing listens on'''
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def raised(function):
+    try:
+        function()
+    except Exception as e:
+        return e
+    raise AssertionError("no exception raised")
+
+
+@pytest.mark.parametrize('error, idempotent, not_idempotent', [
+    (E.ConnectTimeout(), True, True),
+    (connectionError(urllib3.exceptions.NewConnectionError(None, 'refused')), True, True),
+    (connectionError(urllib3.exceptions.ProtocolError('Connection aborted.')), True, False),
+    (E.ConnectionError('Connection aborted.'), True, False),
+    (E.ReadTimeout(), True, False),
+    (httpError(500), True, False),
+    (httpError(429), True, False),
+    (httpError(404), False, False),
+    (KeyError('resource'), False, False),
+])
+def test_isTransient(error, idempotent, not_idempotent):
+    assert isTransient(error) is idempotent
+    assert isTransient(error, idempotent=False) is not_idempotent
+
+
+def test_isTransient_refused_connection():
+    error = raised(lambda: requests.post('http://127.0.0.1:' + str(freePort()) + '/api/clients/dev/3/0/4', timeout=2))
+    assert isTransient(error, idempotent=False)
+
+
+def test_isTransient_connection_closed_after_sending():
+    port = closingServer()
+    error = raised(lambda: requests.post('http://127.0.0.1:' + str(port) + '/api/clients/dev/3/0/4', timeout=2))
+    assert isinstance(error, E.ConnectionError)
+    assert isTransient(error)
+    assert not isTransient(error, idempotent=False)
+
+
+class FakeClient():
+    def __init__(self, server, endpoint):
+        self.server = server
+        self.endpoint = endpoint
+
+    def execute(self, resource):
+        return self.server.call(self.endpoint, 'execute')
+
+    def write(self, text, resource):
+        return self.server.call(self.endpoint, 'write')
+
+
+class FakeServer():
+    '''server whose clients raise the errors queued for their endpoint before succeeding'''
+
+    def __init__(self, endpoints, errors=None):
+        self.endpoints = endpoints
+        self.errors = {endpoint: list(errors.get(endpoint, [])) for endpoint in endpoints} if errors else {}
+        self.calls = []  # (time, endpoint, operation) of every call
+        self.lock = threading.Lock()
+
+    def getClients(self):
+        return list(self.endpoints)
+
+    def getClient(self, endpoint):
+        return FakeClient(self, endpoint)
+
+    def maxWorkers(self, max_workers):
+        return max_workers
+
+    def call(self, endpoint, operation):
+        with self.lock:
+            self.calls.append((time.monotonic(), endpoint, operation))
+            errors = self.errors.get(endpoint)
+            error = errors.pop(0) if errors else None
+        if error is not None:
+            raise error
+
+    def count(self, endpoint):
+        return sum(1 for _, ep, _ in self.calls if ep == endpoint)
+
+
+def test_transient_failures_are_retried():
+    server = FakeServer(['a', 'b'], {'a': [E.ReadTimeout(), httpError(503)]})
+    summary = Campaign(server, 'write', ('1', 'Lifetime'), backoff=0.01, report_interval=0.05).run()
+    assert summary['done'] == 2 and summary['failed'] == 0
+    assert server.count('a') == 3 and server.count('b') == 1
+
+
+def test_retries_give_up():
+    server = FakeServer(['a'], {'a': [E.ReadTimeout()] * 5})
+    campaign = Campaign(server, 'write', ('1', 'Lifetime'), retries=2, backoff=0.01, report_interval=0.05)
+    summary = campaign.run()
+    assert summary['failed'] == 1
+    assert server.count('a') == 3
+    assert campaign.state['a']['attempts'] == 3
+
+
+def test_execute_is_not_retried_once_sent():
+    server = FakeServer(['a', 'b'], {'a': [E.ReadTimeout()], 'b': [E.ConnectionError('Connection aborted.')]})
+    summary = Campaign(server, 'execute', ('Reboot',), backoff=0.01, report_interval=0.05).run()
+    assert summary['failed'] == 2
+    assert server.count('a') == 1 and server.count('b') == 1
+
+
+def test_execute_is_retried_when_not_sent():
+    server = FakeServer(['a'], {'a': [E.ConnectTimeout(), connectionError(urllib3.exceptions.NewConnectionError(None, 'x'))]})
+    summary = Campaign(server, 'execute', ('Reboot',), backoff=0.01, report_interval=0.05).run()
+    assert summary['done'] == 1
+    assert server.count('a') == 3
+
+
+def test_permanent_failure_is_not_retried():
+    server = FakeServer(['a'], {'a': [httpError(404)]})
+    summary = Campaign(server, 'write', ('1', 'Lifetime'), backoff=0.01, report_interval=0.05).run()
+    assert summary['failed'] == 1 and server.count('a') == 1
+
+
+def test_resume_skips_finished_endpoints(tmp_path):
+    state_path = str(tmp_path / 'campaign.json')
+    with open(state_path, 'w') as f:
+        json.dump({'a': {'status': 'done', 'attempts': 1, 'error': None},
+                   'b': {'status': 'failed', 'attempts': 4, 'error': 'ReadTimeout()'},
+                   'c': {'status': 'retrying', 'attempts': 1, 'error': 'ReadTimeout()'}}, f)
+    server = FakeServer(['a', 'b', 'c', 'd'])
+    summary = Campaign(server, 'write', ('1', 'Lifetime'), state_path=state_path, report_interval=0.05).run()
+    assert sorted(endpoint for _, endpoint, _ in server.calls) == ['c', 'd']
+    assert summary['done'] == 3 and summary['failed'] == 1
+    with open(state_path) as f:
+        state = json.load(f)
+    assert state['c'] == {'status': 'done', 'attempts': 2, 'error': None}
+    assert state['d']['status'] == 'done'
+
+
+def test_stopped_campaign_resumes_where_it_stopped(tmp_path):
+    state_path = str(tmp_path / 'campaign.json')
+    endpoints = ['device-' + str(i) for i in range(20)]
+    server = FakeServer(endpoints)
+    campaign = Campaign(server, 'write', ('1', 'Lifetime'), rate=50, max_workers=1, state_path=state_path,
+                        report_interval=0.05)
+    threading.Timer(0.1, campaign.stop).start()
+    first = campaign.run()
+    assert 0 < first['done'] < len(endpoints)
+    summary = Campaign(server, 'write', ('1', 'Lifetime'), state_path=state_path, report_interval=0.05).run()
+    assert summary['done'] == len(endpoints)
+    # every endpoint ran exactly once over both runs
+    assert sorted(endpoint for _, endpoint, _ in server.calls) == sorted(endpoints)
+
+
+def test_rate_limits_the_whole_campaign():
+    server = FakeServer(['device-' + str(i) for i in range(11)])
+    start = time.monotonic()
+    Campaign(server, 'write', ('1', 'Lifetime'), rate=20, max_workers=10, report_interval=0.05).run()
+    # a burst of one then ten more operations at twenty per second
+    assert time.monotonic() - start >= 0.45
+    times = sorted(t for t, _, _ in server.calls)
+    assert times[-1] - times[0] >= 0.45
+
+
+def test_endpoint_rate_spaces_retries_of_an_endpoint():
+    server = FakeServer(['a', 'b'], {'a': [E.ReadTimeout(), E.ReadTimeout()]})
+    Campaign(server, 'write', ('1', 'Lifetime'), endpoint_rate=10, backoff=0, report_interval=0.05).run()
+    times = [t for t, endpoint, _ in server.calls if endpoint == 'a']
+    assert len(times) == 3
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
@@ -0,0 +1,37 @@
+'''
+Tests that SqliteClientStore stops using its database only when the database cannot be opened.
+'''
+import sqlite3
+from LeshanRestAPI import SqliteClientStore, JsonClientStore
+
+PAGE_OBJECTS = {'lwm2m server': {'0': {'Lifetime': '/1/0/1'}}}
+
+
+def test_failed_statement_falls_back_for_that_call_only(tmp_path):
+    path = str(tmp_path / 'clients.sqlite')
+    fallback = JsonClientStore(str(tmp_path / 'json'))
+    store = SqliteClientStore(path, fallback=fallback)
+    store.put('a', PAGE_OBJECTS)
+    with sqlite3.connect(path) as other:
+        other.execute("CREATE TRIGGER fail BEFORE INSERT ON clients BEGIN SELECT RAISE(ABORT, 'database is locked'); END")
+    store.put('b', PAGE_OBJECTS, 'sig')
+    assert fallback.get('b') == PAGE_OBJECTS
+    with sqlite3.connect(path) as other:
+        other.execute('DROP TRIGGER fail')
+    # the database is still used once the statements succeed again
+    store.put('c', PAGE_OBJECTS, 'sig')
+    assert fallback.get('c') is None
+    assert store.get('c', 'sig') == PAGE_OBJECTS
+    assert store.get('a') == PAGE_OBJECTS
+
+
+def test_database_that_cannot_be_opened_is_not_used(tmp_path):
+    folder = tmp_path / 'file'
+    folder.write_text('not a folder')
+    fallback = JsonClientStore(str(tmp_path / 'json'))
+    store = SqliteClientStore(str(folder / 'clients.sqlite'), fallback=fallback)
+    store.put('a', PAGE_OBJECTS)
+    assert fallback.get('a') == PAGE_OBJECTS
+    assert store.get('a') == PAGE_OBJECTS
+    fallback.delete('a')
+    assert store.get('a') is None
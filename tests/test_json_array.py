@@ -0,0 +1,71 @@
+'''
+Tests of iterJSONArray, the incremental parser Server.iterClients reads the registrations with.
+'''
+import json
+import pytest
+from LeshanRestAPI import iterJSONArray
+
+DOCUMENTS = [
+    '[]',
+    '[1]',
+    '[1.5]',
+    '[12.5e3, -0.25E-2, 7]',
+    '[true, false, null]',
+    '["a", "b\\"c", "d\\\\", "\\u00e9\\u1234", "\\ud83d\\ude00"]',
+    '[{"endpoint": "dev-1", "objectLinks": [{"url": "/3/0"}, {"url": "/1/0"}]}, {"endpoint": "dev-2"}]',
+    ' [ 1 ,\n\t2 , [3, [4.0e1]] , {"a": {"b": [null, true]}} ] ',
+    '[' + ', '.join(str(n * 1.25) for n in range(50)) + ']',
+]
+
+
+def chunked(text, size):
+    '''returns text cut in chunks of size characters'''
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_every_chunk_boundary(document):
+    expected = json.loads(document)
+    for size in range(1, len(document) + 1):
+        assert list(iterJSONArray(chunked(document, size))) == expected, size
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_every_split_point(document):
+    expected = json.loads(document)
+    for i in range(len(document) + 1):
+        assert list(iterJSONArray([document[:i], document[i:]])) == expected, i
+
+
+@pytest.mark.parametrize('chunks', [['[1', '.5]'], ['[12', '.5e3]'], ['[1', 'e3]'], ['[-', '1]'], ['[tr', 'ue]']])
+def test_scalar_cut_at_boundary(chunks):
+    assert list(iterJSONArray(chunks)) == json.loads(''.join(chunks))
+
+
+def test_elements_are_yielded_before_the_array_closes():
+    elements = iterJSONArray(iter(['[{"a": 1}, ', '{"b": 2}']))
+    assert next(elements) == {'a': 1}
+    assert next(elements) == {'b': 2}
+
+
+@pytest.mark.parametrize('document', ['[{bad}]', '[1x]', '[truex]', '["a" "b"]', '[{"a" 1}]', '[1.5.5]',
+                                      '[1,]', '[,1]', '[1,,2]'])
+def test_invalid_json_raises(document):
+    for size in range(1, len(document) + 1):
+        with pytest.raises(ValueError):
+            list(iterJSONArray(chunked(document, size)))
+
+
+def test_invalid_json_raises_without_reading_the_rest():
+    def chunks():
+        yield '[{bad}, '
+        raise AssertionError("read past the invalid element")
+
+    with pytest.raises(json.JSONDecodeError):
+        list(iterJSONArray(chunks()))
+
+
+@pytest.mark.parametrize('document', ['', '[1, 2', '[{"a": 1}', '{"a": 1}'])
+def test_not_a_complete_array_raises(document):
+    with pytest.raises(ValueError):
+        list(iterJSONArray([document]))
@@ -0,0 +1,236 @@
+'''
+Tests of the adaptive timeouts and hedged reads of LatencyTracker, against a local server scripted per request.
+'''
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import requests
+from LeshanRestAPI import Client, ClientStore, LatencyTracker, Metrics, TIMEOUT
+
+ENDPOINT = 'device'
+PAGE_OBJECTS = {'lwm2m server': {'0': {'Lifetime': '/1/0/1'}}}
+
+
+class Store(ClientStore):
+    def get(self, endpoint, signature=None):
+        return PAGE_OBJECTS
+
+    def put(self, endpoint, page_objects, signature=None):
+        pass
+
+
+class ScriptedServer():
+    '''server answering each request with the next (delay, status, value) of its script'''
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with server.lock:
+                    delay, status, value = server.script[min(server.requests, len(server.script) - 1)]
+                    server.requests += 1
+                time.sleep(delay)
+                body = json.dumps({'status': 'CONTENT', 'content': {'id': 1, 'value': value}}).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    # the client gave up on this request
+                    pass
+
+            do_PUT = do_GET
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:' + str(self.httpd.server_port) + '/#/clients/' + ENDPOINT
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def scripted():
+    servers = []
+
+    def start(script):
+        server = ScriptedServer(script)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def warm(tracker, seconds, n=10):
+    for _ in range(n):
+        tracker.record(ENDPOINT, seconds)
+
+
+def test_timeout_is_the_default_until_there_are_enough_samples():
+    tracker = LatencyTracker(min_samples=5)
+    warm(tracker, 0.5, 4)
+    assert tracker.timeout(ENDPOINT, 3) == 3
+    tracker.record(ENDPOINT, 0.5)
+    assert tracker.timeout(ENDPOINT, 3) == pytest.approx(1.0)
+
+
+def test_timeout_follows_the_percentile_within_bounds():
+    tracker = LatencyTracker(percentile=0.9, multiplier=3, min_timeout=0.5, max_timeout=10)
+    warm(tracker, 0.3, 9)
+    tracker.record(ENDPOINT, 2.0)
+    assert tracker.timeout(ENDPOINT) == pytest.approx(6.0)
+    warm(tracker, 0.01, 100)
+    assert tracker.timeout(ENDPOINT) == 0.5
+    warm(tracker, 5.0, 100)
+    assert tracker.timeout(ENDPOINT) == 10
+
+
+def test_timeouts_do_not_grow_the_timeout():
+    tracker = LatencyTracker()
+    warm(tracker, 0.05, 20)
+    assert tracker.timeout(ENDPOINT, 4) == 0.5
+    for _ in range(5):
+        tracker.recordTimeout(ENDPOINT)
+        # never more than the default however many times the device timed out
+        assert tracker.timeout(ENDPOINT, 4) == 4
+    assert tracker.timeouts(ENDPOINT) == 5
+    tracker.record(ENDPOINT, 0.05)
+    assert tracker.timeouts(ENDPOINT) == 0
+    assert tracker.timeout(ENDPOINT, 4) == 0.5
+
+
+def test_hedgeDelay():
+    assert LatencyTracker().hedgeDelay(ENDPOINT) is None
+    tracker = LatencyTracker(hedge=0.9)
+    assert tracker.hedgeDelay(ENDPOINT) is None
+    warm(tracker, 0.01, 9)
+    tracker.record(ENDPOINT, 1.0)
+    assert tracker.hedgeDelay(ENDPOINT) == 1.0
+    warm(tracker, 0.01, 90)
+    assert tracker.hedgeDelay(ENDPOINT) == 0.01
+
+
+def test_submit_does_not_queue():
+    tracker = LatencyTracker(hedge_workers=1)
+    release = threading.Event()
+    first = tracker.submit(release.wait)
+    assert tracker.submit(lambda: None) is None
+    release.set()
+    first.result()
+    assert tracker.submit(lambda: 1).result() == 1
+    tracker.close()
+
+
+def client(server, tracker, metrics=None):
+    return Client(server.url, store=Store(), links=[], latency=tracker, metrics=metrics)
+
+
+def test_adaptive_timeout_is_used(scripted):
+    server = scripted([(0.8, 200, 'slow')])
+    tracker = LatencyTracker()
+    warm(tracker, 0.01)
+    with pytest.raises(requests.exceptions.Timeout):
+        client(server, tracker).read('Lifetime')
+    assert tracker.timeouts(ENDPOINT) == 1
+    # after a timeout the default is given
+    assert client(server, tracker).read('Lifetime') == 'slow'
+
+
+def test_explicit_timeout_is_kept(scripted):
+    server = scripted([(0.3, 200, 'slow')])
+    tracker = LatencyTracker()
+    warm(tracker, 0.01)
+    assert client(server, tracker).read('Lifetime', timeout=2) == 'slow'
+    assert isinstance(TIMEOUT, float) and TIMEOUT == 4
+
+
+def test_hedge_wins_over_a_slow_first_request(scripted):
+    # slower than the hedge delay but within the least timeout of 0.5 seconds
+    server = scripted([(0.3, 200, 'first'), (0, 200, 'hedge')])
+    tracker = LatencyTracker(hedge=0.9)
+    warm(tracker, 0.02)
+    metrics = Metrics()
+    start = time.monotonic()
+    assert client(server, tracker, metrics).read('Lifetime') == 'hedge'
+    assert time.monotonic() - start < 0.25
+    assert metrics.counter('read_hedged') == 1 and metrics.counter('read_hedge_wins') == 1
+    # the slower request finishes in the background and its response time is still recorded
+    time.sleep(0.5)
+    assert server.requests == 2
+    assert tracker.responseTime(ENDPOINT, 1.0) >= 0.3
+    tracker.close()
+
+
+def test_first_request_wins_over_a_slow_hedge(scripted):
+    server = scripted([(0.1, 200, 'first'), (0.5, 200, 'hedge')])
+    tracker = LatencyTracker(hedge=0.9)
+    warm(tracker, 0.02)
+    metrics = Metrics()
+    assert client(server, tracker, metrics).read('Lifetime') == 'first'
+    assert metrics.counter('read_hedged') == 1 and metrics.counter('read_hedge_wins') == 0
+    tracker.close()
+
+
+def test_fast_answer_is_not_hedged(scripted):
+    server = scripted([(0, 200, 'first')])
+    tracker = LatencyTracker(hedge=0.9)
+    warm(tracker, 0.2)
+    metrics = Metrics()
+    assert client(server, tracker, metrics).read('Lifetime') == 'first'
+    assert server.requests == 1 and metrics.counter('read_hedged') == 0
+    tracker.close()
+
+
+def test_failed_first_request_is_covered_by_the_hedge(scripted):
+    server = scripted([(0.1, 500, 'first'), (0.2, 200, 'hedge')])
+    tracker = LatencyTracker(hedge=0.9)
+    warm(tracker, 0.02)
+    assert client(server, tracker).read('Lifetime') == 'hedge'
+    tracker.close()
+
+
+def test_error_before_the_hedge_is_raised(scripted):
+    server = scripted([(0, 404, 'first'), (0, 200, 'hedge')])
+    tracker = LatencyTracker(hedge=0.9)
+    warm(tracker, 0.2)
+    with pytest.raises(requests.exceptions.HTTPError):
+        client(server, tracker).read('Lifetime')
+    assert server.requests == 1
+    tracker.close()
+
+
+def test_both_requests_failing_raises(scripted):
+    server = scripted([(0.1, 500, 'first'), (0.1, 503, 'hedge')])
+    tracker = LatencyTracker(hedge=0.9)
+    warm(tracker, 0.02)
+    with pytest.raises(requests.exceptions.HTTPError):
+        client(server, tracker).read('Lifetime')
+    assert server.requests == 2
+    tracker.close()
+
+
+def test_writes_are_not_hedged(scripted):
+    server = scripted([(0.2, 200, None)])
+    tracker = LatencyTracker(hedge=0.9)
+    warm(tracker, 0.02)
+    metrics = Metrics()
+    client(server, tracker, metrics).write('60', 'Lifetime')
+    assert server.requests == 1 and metrics.counter('write_hedged') == 0
+    tracker.close()
@@ -0,0 +1,77 @@
+'''
+Tests that parsePage gives the same page_objects as the BeautifulSoup walk it replaced, on random client pages.
+'''
+import html
+import json
+import os
+import random
+import sys
+import pytest
+
+pytest.importorskip('bs4')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'benchmarks'))
+
+from LeshanRestAPI import parsePage, DIR_PATH  # noqa: E402
+from parse_bs4 import parseHTML  # noqa: E402
+from bench import buildHTML  # noqa: E402
+
+NAME_CHARACTERS = 'abcXYZ019 _-&<>"\'é'
+
+
+def randomName(rng):
+    '''returns a random name escaped for html, with some whitespace around it'''
+    name = ''.join(rng.choice(NAME_CHARACTERS) for _ in range(rng.randint(1, 12)))
+    return rng.choice(['', ' ', '\n  ']) + html.escape(name) + rng.choice(['', ' ', ' <br>', '\n'])
+
+
+def randomMarkup(rng, inner):
+    '''returns inner wrapped in elements that are not part of the tree of objects'''
+    for _ in range(rng.randint(0, 2)):
+        tag = rng.choice(['div', 'span', 'ul', 'li'])
+        inner = '<{0} class="x">{1}</{0}>'.format(tag, inner)
+    return inner
+
+
+def randomPage(rng):
+    '''returns the html of a random client page'''
+    parts = ['<html><body><h1>Client</h1>']
+    for _ in range(rng.randint(0, 5)):
+        object_name = randomName(rng)
+        if rng.random() < 0.3:
+            # the name of an object may be split by other elements
+            object_name = '<b>' + object_name + '</b> <i>(' + str(rng.randint(0, 9)) + ')</i>'
+        parts.append('<div ng-repeat="object in objects"><div><span class="object-name">'
+                     + object_name + '</span></div>')
+        for _ in range(rng.randint(0, 4)):
+            resources = []
+            for _ in range(rng.randint(0, 6)):
+                path = '/{}/{}/{}'.format(rng.randint(0, 40000), rng.randint(0, 3), rng.randint(0, 30))
+                resources.append(randomMarkup(
+                    rng, '<div ng-repeat="resource in instance.resources" class="resource">'
+                         '<span class="resource-name">' + randomName(rng) + '</span>'
+                         '<button tooltip-html-unsafe="Path&gt;' + path + '">Read</button>'
+                         '<button tooltip-html-unsafe="Observe&gt;">Observe</button></div>'))
+            parts.append(randomMarkup(rng, '<div ng-repeat="instance in object.instances">' + ''.join(resources)
+                                      + '</div>'))
+        parts.append('</div>')
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def assertSameObjects(html_text):
+    expected = parseHTML(html_text)
+    actual = parsePage(html_text)
+    assert actual == expected
+    # the order of the resources decides which match is found first so it must be the same too
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+@pytest.mark.parametrize('seed', range(500))
+def test_random_pages(seed):
+    assertSameObjects(randomPage(random.Random(seed)))
+
+
+def test_cached_clients():
+    with open(os.path.join(DIR_PATH, 'cached_clients', 'hexa_test.json')) as f:
+        page_objects = json.load(f)
+    assertSameObjects(buildHTML(page_objects))
@@ -0,0 +1,22 @@
+'''
+Tests that the fleet wide operations of Server never run more workers than its connection pool holds.
+'''
+import requests
+from LeshanRestAPI import Server, MAX_WORKERS, POOL_MAXSIZE
+
+
+def test_workers_are_capped_at_the_pool():
+    server = Server('http://127.0.0.1')
+    assert MAX_WORKERS <= POOL_MAXSIZE
+    assert server.maxWorkers(20) == POOL_MAXSIZE
+    assert server.maxWorkers(3) == 3
+    assert server.maxWorkers(0) == 1
+
+
+def test_workers_follow_the_pool_size():
+    assert Server('http://127.0.0.1', pool_maxsize=20).maxWorkers(20) == 20
+    assert Server('http://127.0.0.1', pool_maxsize=20).maxWorkers(50) == 20
+
+
+def test_session_passed_in_is_not_capped():
+    assert Server('http://127.0.0.1', session=requests.Session()).maxWorkers(50) == 50